@@ -1,72 +1,230 @@
 # adk_utils.py
+from __future__ import annotations
 import re
+import functools
 import base64
 import asyncio
-import uuid
+import secrets
 import io
-import os # Import os to modify environment variable
-from cryptography.fernet import Fernet # Import Fernet
-
-# --- ADK Imports ---
-from google.adk.sessions import InMemorySessionService
-from google.adk.runners import Runner
-from google.adk.agents import Agent # Import Agent for type hinting
-from google.genai import types as google_genai_types # For Content/Part
+import itertools
+import os
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import TYPE_CHECKING
+from cryptography.fernet import Fernet # Import Fernet (legacy tokens)
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# --- ADK Imports (type hints only; runtime imports are lazy, see _lazy_import) ---
+if TYPE_CHECKING:
+    from google.adk.sessions import InMemorySessionService
+    from google.adk.runners import Runner
+    from google.adk.agents import Agent
+    from google.genai import Client as GenaiClient
+    from google.genai import types as google_genai_types # For Content/Part
 
 # --- Local Imports ---
 from config import APP_NAME, ENCRYPTION_KEY # Import configured app name and encryption key
 
-# --- Initialize Fernet ---
-# Ensure the encryption key is valid before initializing Fernet
+logger = logging.getLogger(__name__)
+
+# --- Precompiled SVG fence pattern (only used when a response is fenced) ---
+_SVG_FENCE_PREFIX_RE = re.compile(r'^\s*```(?:svg|xml)?\s*', re.IGNORECASE)
+# Case-insensitive tag probes, so is_valid_svg never builds a lowercased copy of the SVG
+_HAS_SVG_OPEN = re.compile(r'<svg', re.IGNORECASE)
+_HAS_SVG_CLOSE = re.compile(r'</svg>', re.IGNORECASE)
+_SVG_TAIL_WINDOW = 512 # The closing tag is expected within this many chars of the end
+
+# --- Font Awesome styles spliced into generated SVGs ---
+# The create agent only references these classes; the literal block is added here instead of
+# being part of its instruction (and regenerated token by token in every response).
+FONT_AWESOME_DEFS_BLOCK = """<defs><style>
+@font-face { font-family: 'Font Awesome 6 Free'; font-style: normal; font-weight: 900; src: url('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.2/webfonts/fa-solid-900.woff2') format('woff2'); }
+@font-face { font-family: 'Font Awesome 6 Brands'; font-style: normal; font-weight: 400; src: url('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.2/webfonts/fa-brands-400.woff2') format('woff2'); }
+.fa-solid-icon { font-family: 'Font Awesome 6 Free', sans-serif; font-weight: 900; }
+.fa-brand-icon { font-family: 'Font Awesome 6 Brands', sans-serif; font-weight: 400; }
+</style></defs>"""
+_SVG_OPEN_TAG_RE = re.compile(r'<svg\b[^>]*>', re.IGNORECASE)
+
+# --- SVG output minification ---
+_SVG_ATTR_RE = re.compile(r'(\s[\w:.-]+)="([^"]*)"')
+# One SVG number token. Matching whole tokens left to right keeps compact path data such as
+# "M1.5.999" (1.5 then .999) split where the SVG grammar splits it.
+_SVG_NUMBER_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_INDENT_BETWEEN_TAGS_RE = re.compile(r'>\s*\n\s*<')
+_NON_NUMERIC_ATTRS = frozenset(("id", "class", "href", "xlink:href", "font-family")) # Values that may contain digits but are not numbers
+
+# --- Markdown brief compaction ---
+_MD_FENCE_WRAP_RE = re.compile(r'^\s*```(?:markdown|md)?\s*\n(.*?)\n\s*```\s*$', re.IGNORECASE | re.DOTALL)
+_MD_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
+_MD_RULE_LINE_RE = re.compile(r'^[ \t]*-{3,}[ \t]*\n', re.MULTILINE)
+_MD_TRAILING_SPACE_RE = re.compile(r'[ \t]+$', re.MULTILINE)
+_MD_BLANK_RUN_RE = re.compile(r'\n{3,}')
+
+# --- Initialize Ciphers ---
+# New API keys are sealed with AES-256-GCM (AES-NI accelerated in OpenSSL, no base64/HMAC
+# framing like Fernet). Its key is derived from ENCRYPTION_KEY with HKDF so the raw Fernet
+# key material is never reused across algorithms. Ciphertext is stored as raw bytes
+# (Firestore bytes field); Fernet is kept only to decrypt str tokens stored before the switch.
+_AESGCM_NONCE_SIZE = 12
 try:
     if ENCRYPTION_KEY:
         fernet = Fernet(ENCRYPTION_KEY)
-        print("Fernet encryption initialized.")
+        _aead = AESGCM(HKDF(
+            algorithm=hashes.SHA256(), length=32, salt=None, info=b"designo-api-key-aesgcm"
+        ).derive(base64.urlsafe_b64decode(ENCRYPTION_KEY)))
+        print("AES-GCM encryption initialized (Fernet available for legacy keys).")
     else:
         fernet = None
+        _aead = None
         print("WARNING: ENCRYPTION_KEY is not set. Encryption/Decryption functions will not work.")
 except Exception as e:
      fernet = None
-     print(f"ERROR: Failed to initialize Fernet with provided key: {e}. Encryption/Decryption will not work.")
+     _aead = None
+     print(f"ERROR: Failed to initialize ciphers with provided key: {e}. Encryption/Decryption will not work.")
 
 
 # --- Encryption/Decryption Helpers ---
-def encrypt_api_key(api_key: str) -> str | None:
-    """Encrypts a string using Fernet."""
-    if not fernet:
+# The ciphers are fixed at import, so pick the implementation once here
+# instead of testing `if not fernet` on every call.
+if _aead:
+    _aead_encrypt = _aead.encrypt
+    _aead_decrypt = _aead.decrypt
+    _fernet_decrypt = fernet.decrypt
+
+    def encrypt_api_key(api_key: str) -> bytes | None:
+        """Encrypts a string using AES-GCM. Returns raw nonce||ciphertext bytes for storage."""
+        try:
+            nonce = secrets.token_bytes(_AESGCM_NONCE_SIZE)
+            return nonce + _aead_encrypt(nonce, api_key.encode(), None)
+        except Exception as e:
+            print(f"Error during encryption: {e}")
+            return None
+
+    def decrypt_api_key(encrypted_api_key: bytes | str) -> str | None:
+        """Decrypts bytes produced by encrypt_api_key (AES-GCM) or a legacy Fernet str token."""
+        if not encrypted_api_key:
+            return None # Cannot decrypt empty value
+        try:
+            if isinstance(encrypted_api_key, bytes):
+                nonce = encrypted_api_key[:_AESGCM_NONCE_SIZE]
+                return _aead_decrypt(nonce, encrypted_api_key[_AESGCM_NONCE_SIZE:], None).decode()
+            # Legacy Fernet token (str) stored before the AES-GCM switch
+            return _fernet_decrypt(encrypted_api_key.encode()).decode()
+        except Exception as e:
+            print(f"Error during decryption: {e}. The key might be invalid or the decryption key is wrong.")
+            return None
+else:
+    def encrypt_api_key(api_key: str) -> bytes | None:
+        """Encryption is unavailable without a valid ENCRYPTION_KEY."""
         print("Encryption key not available or invalid. Cannot encrypt.")
         return None
-    try:
-        # API key should be bytes for Fernet
-        encrypted_bytes = fernet.encrypt(api_key.encode())
-        return encrypted_bytes.decode() # Return as string for storage
-    except Exception as e:
-        print(f"Error during encryption: {e}")
-        return None
 
-def decrypt_api_key(encrypted_api_key: str) -> str | None:
-    """Decrypts a string using Fernet."""
-    if not fernet:
+    def decrypt_api_key(encrypted_api_key: bytes | str) -> str | None:
+        """Decryption is unavailable without a valid ENCRYPTION_KEY."""
         print("Encryption key not available or invalid. Cannot decrypt.")
         return None
-    if not encrypted_api_key:
-        return None # Cannot decrypt empty string
-    try:
-        # Encrypted key is a string, encode back to bytes
-        decrypted_bytes = fernet.decrypt(encrypted_api_key.encode())
-        return decrypted_bytes.decode() # Return as original string
-    except Exception as e:
-        print(f"Error during decryption: {e}. The key might be invalid or the decryption key is wrong.")
-        return None
 
 
-# --- ADK Session Service (Single instance for the application) ---
-# Note: InMemorySessionService is not persistent. For a production app, use
-# a persistent storage solution like Firestore or a database.
-# If using a persistent session service, it might handle per-user history
-# automatically if you configure it correctly.
-session_service = InMemorySessionService()
-print("ADK InMemorySessionService initialized.")
+# --- Lazy ADK Imports ---
+# Importing anything under google.adk pulls in the whole ADK package (runners, agents,
+# genai, protobuf, grpc, ...). Defer it until an agent actually runs, so importing this
+# module just for is_valid_svg or the encryption helpers stays cheap.
+_runner_cls = None
+_genai_client_cls = None
+_streaming_run_config = None # RunConfig with SSE streaming, used when partial text is consumed
+
+def _lazy_import():
+    """Imports the ADK/genai classes used at runtime on first call."""
+    global _runner_cls, _genai_client_cls, _streaming_run_config
+    if _runner_cls is None:
+        from google.adk.runners import Runner
+        from google.adk.agents.run_config import RunConfig, StreamingMode
+        from google.genai import Client
+        _runner_cls, _genai_client_cls = Runner, Client
+        _streaming_run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+
+
+# --- Per-Request Gemini Credentials ---
+# The genai client for the current agent run is bound to a ContextVar instead of
+# swapping os.environ["GOOGLE_API_KEY"], which raced between concurrent requests
+# using different keys. ContextVars are coroutine-local, so each request sees its own.
+_request_genai_client: ContextVar[GenaiClient | None] = ContextVar("request_genai_client", default=None)
+_default_genai_client: GenaiClient | None = None # Built lazily from the server's GOOGLE_API_KEY
+_GENAI_CLIENT_CACHE_SIZE = 64 # Pooled keys plus recently active BYOK users
+
+@functools.lru_cache(maxsize=_GENAI_CLIENT_CACHE_SIZE)
+def genai_client_for_key(api_key: str) -> GenaiClient:
+    """
+    Returns a genai Client for api_key, reused across runs so its HTTP connection pool
+    (and the TCP/TLS handshakes behind it) is shared instead of rebuilt for every agent call.
+    """
+    _lazy_import()
+    return _genai_client_cls(api_key=api_key)
+
+@functools.cache
+def _context_key_gemini_cls():
+    """Builds the ContextKeyGemini class on first access (it subclasses ADK's Gemini)."""
+    from google.adk.models import Gemini
+    _lazy_import()
+
+    class ContextKeyGemini(Gemini):
+        """Gemini model whose client follows the API key bound to the current agent run."""
+
+        @property
+        def api_client(self) -> GenaiClient:
+            global _default_genai_client
+            client = _request_genai_client.get()
+            if client is not None:
+                return client
+            if _default_genai_client is None:
+                _default_genai_client = _genai_client_cls()
+            return _default_genai_client
+
+    return ContextKeyGemini
+
+
+def __getattr__(name):
+    """Resolves the ADK-backed module attributes lazily (PEP 562)."""
+    if name == "session_service":
+        # --- ADK Session Service (Single instance for the application) ---
+        # Note: InMemorySessionService is not persistent. For a production app, use
+        # a persistent storage solution like Firestore or a database.
+        # If using a persistent session service, it might handle per-user history
+        # automatically if you configure it correctly.
+        from google.adk.sessions import InMemorySessionService
+        service = InMemorySessionService()
+        globals()["session_service"] = service # Cache so later lookups skip __getattr__
+        print("ADK InMemorySessionService initialized.")
+        return service
+    if name == "ContextKeyGemini":
+        return _context_key_gemini_cls()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# --- Runner Cache ---
+# Runners hold no per-session state (the session id is passed to run_async), so one
+# Runner per (agent, session service) pair is built lazily and reused across requests.
+# Agents are module-level singletons in agents.py, so their id() is stable.
+_RUNNER_CACHE: dict[tuple[int, int], Runner] = {}
+
+def _get_runner(agent_to_run: Agent, session_service_instance: InMemorySessionService) -> Runner:
+    """Returns the cached Runner for this agent/session service, creating it on first use."""
+    cache_key = (id(agent_to_run), id(session_service_instance))
+    runner = _RUNNER_CACHE.get(cache_key)
+    if runner is None:
+        _lazy_import()
+        runner = _runner_cls(
+            agent=agent_to_run,
+            app_name=APP_NAME,
+            session_service=session_service_instance
+        )
+        _RUNNER_CACHE[cache_key] = runner
+    return runner
 
 # --- Helper Function to Validate SVG (remains the same) ---
 def is_valid_svg(svg_string):
@@ -77,40 +235,204 @@ def is_valid_svg(svg_string):
     """
     if not svg_string or not isinstance(svg_string, str):
         return False
+    return _clean_and_validate_svg(svg_string)
+
+@functools.lru_cache(maxsize=256)
+def _clean_and_validate_svg(svg_string: str):
+    """Cached worker for is_valid_svg; only ever called with a non-empty str."""
+    svg_clean = svg_string.strip()
 
-    # Remove markdown-style code block indicators like ```svg, ```xml, or backticks
-    svg_clean = re.sub(r'^\s*```(?:svg|xml)?\s*', '', svg_string.strip(), flags=re.IGNORECASE)
-    svg_clean = re.sub(r'\s*```\s*$', '', svg_clean, flags=re.IGNORECASE)
+    # Remove markdown-style code block indicators like ```svg, ```xml, or backticks.
+    # Most agent responses are unfenced, so only fall back to the regex when needed.
+    if svg_clean.startswith('```'):
+        svg_clean = _SVG_FENCE_PREFIX_RE.sub('', svg_clean, count=1)
+    if svg_clean.endswith('```'):
+        svg_clean = svg_clean[:-3].rstrip()
 
-    # Normalize whitespace and lowercase for tag checks
-    svg_clean_lower = svg_clean.lower()
+    # Checks run cheapest-first and bail on the first failure, so conversational
+    # (non-SVG) text is usually rejected by the O(1) start/end checks alone.
 
-    # Check presence of basic opening and closing SVG tags
-    has_svg_start = '<svg' in svg_clean_lower
-    has_svg_end = '</svg>' in svg_clean_lower
+    # Basic check: ensure the string starts roughly where an SVG should
+    if not svg_clean.startswith('<'):
+        return False
 
     # Ensure final tag closes properly
-    ends_with_gt = svg_clean.strip().endswith('>')
+    if not svg_clean.endswith('>'):
+        return False
 
-    # Basic check: ensure the string starts roughly where an SVG should
-    starts_with_lt = svg_clean.strip().startswith('<')
+    # Check presence of the closing SVG tag. It is looked for in the tail first and
+    # only falls back to a full scan on a miss.
+    if (_HAS_SVG_CLOSE.search(svg_clean, max(0, len(svg_clean) - _SVG_TAIL_WINDOW)) is None
+            and _HAS_SVG_CLOSE.search(svg_clean) is None):
+        return False
+
+    # Check presence of the opening SVG tag (the search stops at the first hit near the top)
+    if _HAS_SVG_OPEN.search(svg_clean) is None:
+        return False
 
     # Return the cleaned SVG string if validation passes
-    if has_svg_start and has_svg_end and ends_with_gt and starts_with_lt:
-        return svg_clean.strip()
-    else:
-        # print(f"Validation failed for SVG snippet: {svg_string[:200]}...")
-        return False # Return False if validation fails
+    return svg_clean
+
+
+def _round_decimal(match) -> str:
+    number = match.group()
+    dot = number.find('.')
+    # Integers, numbers with <= 2 decimals and exponent forms are kept as written
+    if dot < 0 or len(number) - dot <= 3 or 'e' in number or 'E' in number:
+        return number
+    rounded = f"{float(number):.2f}".rstrip('0').rstrip('.')
+    if rounded == "-0":
+        rounded = "0"
+    # The token's own '.' or '-' may have been its only separator from the previous number
+    start = match.start()
+    if start and rounded[0].isdigit() and (match.string[start - 1].isdigit() or match.string[start - 1] == '.'):
+        rounded = " " + rounded
+    return rounded
+
+
+def _round_attr_decimals(match) -> str:
+    name, value = match.group(1), match.group(2)
+    if name.strip() in _NON_NUMERIC_ATTRS:
+        return match.group()
+    return f'{name}="{_SVG_NUMBER_RE.sub(_round_decimal, value)}"'
+
+
+def minify_svg(svg: str) -> str:
+    """
+    Shrinks a generated SVG: numbers in attribute values (coordinates, path data, ...) are
+    rounded to 2 decimal places and newline indentation between tags is removed.
+    Text content, ids, classes and links are left untouched.
+    """
+    svg = _SVG_ATTR_RE.sub(_round_attr_decimals, svg)
+    return _INDENT_BETWEEN_TAGS_RE.sub('><', svg)
+
+
+def compact_markdown(text: str) -> str:
+    """
+    Strips formatting that costs prompt tokens without carrying meaning for another agent:
+    a wrapping ```markdown fence, bold markers, horizontal rules, trailing spaces and
+    blank-line runs. Headings, list structure and wording are kept.
+    """
+    fenced = _MD_FENCE_WRAP_RE.match(text)
+    if fenced:
+        text = fenced.group(1)
+    text = _MD_BOLD_RE.sub(r'\1', text)
+    text = _MD_RULE_LINE_RE.sub('', text)
+    text = _MD_TRAILING_SPACE_RE.sub('', text)
+    return _MD_BLANK_RUN_RE.sub('\n\n', text).strip()
+
+
+def inject_font_awesome_styles(svg: str) -> str:
+    """
+    Inserts FONT_AWESOME_DEFS_BLOCK right after the opening <svg> tag when the SVG uses the
+    Font Awesome classes and does not define the fonts itself.
+    """
+    if "fa-solid-icon" not in svg and "fa-brand-icon" not in svg:
+        return svg
+    if "Font Awesome 6" in svg and "@font-face" in svg:
+        return svg # The model wrote the block anyway
+    match = _SVG_OPEN_TAG_RE.search(svg)
+    if not match:
+        return svg
+    return svg[:match.end()] + FONT_AWESOME_DEFS_BLOCK + svg[match.end():]
+
+
+def looks_like_svg_prefix(partial_text: str) -> bool:
+    """
+    Incremental check for a streamed SVG response: False once the leading text shows the
+    model is not producing SVG (it must open with a tag or a code fence). An empty prefix
+    is still undecided and passes.
+    """
+    head = partial_text.lstrip()[:3]
+    return not head or head.startswith('<') or "```".startswith(head)
+
+
+# --- Exact Response Cache ---
+class LLMCache:
+    """
+    Exact-match cache of agent responses keyed by (agent, model, request content), with a
+    TTL per entry. Least recently used entries are evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict() # key -> (text, expires_at)
+
+    @staticmethod
+    def make_key(agent: Agent, user_content: google_genai_types.Content) -> str | None:
+        """sha256 over the agent, its model and every text/image part; None if a part is neither."""
+        hasher = hashlib.sha256()
+        hasher.update(agent.name.encode())
+        hasher.update(b"\0" + str(getattr(agent.model, "model", agent.model)).encode())
+        for part in user_content.parts or ():
+            if part.text is not None:
+                hasher.update(b"\0t" + part.text.encode())
+            elif part.inline_data is not None:
+                hasher.update(b"\0b" + (part.inline_data.mime_type or "").encode() + b"\0")
+                hasher.update(part.inline_data.data or b"")
+            else:
+                return None # Function calls, file references, ...: not worth keying
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        text, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return text
+
+    def set(self, key: str, text: str, ttl_seconds: float):
+        self._entries[key] = (text, time.monotonic() + ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+llm_cache = LLMCache()
 
 
 # --- ADK Interaction Runner ---
 
+# Error strings built on the escalation/exception paths of run_adk_interaction
+_AGENT_ERROR_PREFIX = "AGENT_ERROR: "
+_ADK_RUNTIME_ERROR_PREFIX = "ADK_RUNTIME_ERROR: "
+_ESCALATE_PREFIX = "Agent escalated: "
+_ESCALATE_EARLY_PREFIX = "Agent escalated before final response: "
+_NO_MSG = "No specific message."
+_STREAM_ABORTED_PREFIX = "Streamed output rejected after "
+# Leading non-blank characters a partial_text_check gets to see (looks_like_svg_prefix needs 3)
+PARTIAL_TEXT_CHECK_CHARS = 64
+
+# Temporary session ids only need to be unique within this process (sessions live in memory
+# and are deleted after each run), so a counter replaces a random token per call
+_SESSION_ID_PREFIX = f"session_{os.getpid()}_"
+_session_counter = itertools.count()
+
 # Modify the function to accept an optional API key
-async def run_adk_interaction(agent_to_run: Agent, user_content: google_genai_types.Content, session_service_instance: InMemorySessionService, user_id: str = "figma_user", api_key: str | None = None):
+async def run_adk_interaction(agent_to_run: Agent, user_content: google_genai_types.Content, session_service_instance: InMemorySessionService, user_id: str = "figma_user", api_key: str | None = None, partial_text_check=None, genai_client: GenaiClient | None = None, cache_ttl: float | None = None, cache_check=None):
     """
     Runs a single ADK agent interaction using a temporary session and returns the final text response.
-    Optionally uses a specific API key instead of the default GOOGLE_API_KEY env var.
+    Optionally uses a specific API key instead of the server's default GOOGLE_API_KEY.
+    The key only takes effect for agents whose model is a ContextKeyGemini.
+    A prebuilt genai_client (see genai_client_for_key) can be passed instead of api_key.
+    If partial_text_check is given, the response is streamed and the leading text received so
+    far is passed to it after each chunk, until PARTIAL_TEXT_CHECK_CHARS non-blank characters
+    have arrived; returning False stops generation with an AGENT_ERROR.
+    If cache_ttl is given, an identical earlier request (same agent, model and content) is
+    answered from llm_cache, and a successful response is cached for cache_ttl seconds.
+    cache_check, if given, must also accept the response (return truthy) for it to be cached,
+    so output the caller would reject (e.g. truncated SVG) is never replayed.
+    Leave it unset for agents whose answers must be fresh (e.g. ones using google_search).
     """
+    cache_key = LLMCache.make_key(agent_to_run, user_content) if cache_ttl else None
+    if cache_key:
+        cached_text = llm_cache.get(cache_key)
+        if cached_text is not None:
+            return cached_text
+
     final_response_text = None
     # Create a unique session ID per agent call within a single request cycle
     # Note: This means history is NOT preserved *between* different agent calls
@@ -119,9 +441,14 @@ async def run_adk_interaction(agent_to_run: Agent, user_content: google_genai_ty
     # (e.g., modify agent remembering something from a previous create call),
     # the session management logic needs to be different (e.g., pass a consistent
     # session ID throughout the /generate request flow).
-    session_id = f"session_{uuid.uuid4()}"
+    session_id = _SESSION_ID_PREFIX + str(next(_session_counter))
 
-    original_api_key_env = os.environ.get("GOOGLE_API_KEY") # Store original env var
+    # --- Bind a client for the user-provided API key to this run only ---
+    _lazy_import()
+    if genai_client is None and api_key:
+        genai_client = genai_client_for_key(api_key)
+    client_token = _request_genai_client.set(genai_client)
+    events = None # The runner's event stream, closed explicitly in finally
 
     try:
         # Create a temporary session for this specific agent interaction
@@ -131,77 +458,105 @@ async def run_adk_interaction(agent_to_run: Agent, user_content: google_genai_ty
         )
         # print(f"Running agent '{agent_to_run.name}' in temporary session '{session_id}' for user '{user_id}'...")
 
-        # --- Temporarily set the environment variable if a user API key is provided ---
-        if api_key:
-            # print(f"Using user-provided API key for agent '{agent_to_run.name}'...")
-            os.environ["GOOGLE_API_KEY"] = api_key
-        # else:
-            # print(f"Using server's default API key for agent '{agent_to_run.name}'...")
+        runner = _get_runner(agent_to_run, session_service_instance) # Reuse the Runner for this agent
 
+        # Runner.run_async defaults to a non-streaming RunConfig; only override it when streaming
+        run_kwargs = {"run_config": _streaming_run_config} if partial_text_check else {}
+        streamed_head = "" # Leading streamed text, only kept while it is being checked
+        checking_stream = partial_text_check is not None
+        log_events = logger.isEnabledFor(logging.DEBUG) # Checked once per run, not per event
 
-        runner = Runner(
-            agent=agent_to_run,
-            app_name=APP_NAME,
-            session_service=session_service_instance # Use the passed instance
+        events = runner.run_async(
+            user_id=user_id, session_id=session_id, new_message=user_content, **run_kwargs
         )
-
-        async for event in runner.run_async(
-            user_id=user_id, session_id=session_id, new_message=user_content
-        ):
-            # print(f"  [Event] Author: {event.author}, Type: {type(event).__name__}, Final: {event.is_final_response()}, Action: {event.actions}") # Debug logging
+        async for event in events:
+            if log_events:
+                logger.debug("[Event] Author: %s Type: %s Final: %s", event.author, type(event).__name__, event.is_final_response())
+
+            # Resolve the escalation flag once per event
+            actions = event.actions
+            escalated = actions.escalate if actions else False
+
+            # Validate streamed text as it arrives; a break ends the run (the stream is closed in finally)
+            if event.partial:
+                content = event.content
+                if checking_stream and content and content.parts:
+                    streamed_head += "".join(part.text for part in content.parts if part.text)
+                    if not partial_text_check(streamed_head):
+                        final_response_text = _AGENT_ERROR_PREFIX + _STREAM_ABORTED_PREFIX + f"{len(streamed_head)} chars: {streamed_head[:200]}"
+                        print(f"  ERROR: {final_response_text}")
+                        break
+                    # The prefix is decided; later deltas are neither buffered nor re-checked
+                    checking_stream = len(streamed_head.lstrip()) < PARTIAL_TEXT_CHECK_CHARS
+                continue
 
             # Handle final response
             if event.is_final_response():
-                if event.content and event.content.parts:
+                content = event.content
+                if content and content.parts:
                     # Concatenate all text parts that are not None
-                    final_response_text = "".join(str(part.text) for part in event.content.parts if part.text is not None)
-                    # print(f"  Final response text received (len={len(final_response_text or '')}).")
+                    final_response_text = "".join([part.text for part in content.parts if part.text is not None])
+                    if log_events:
+                        logger.debug("Final response text received (len=%d).", len(final_response_text))
 
                 # Check for escalation *even* on final response event
-                if event.actions and event.actions.escalate:
-                    error_msg = f"Agent escalated: {event.error_message or 'No specific message.'}"
+                if escalated:
+                    error_msg = _ESCALATE_PREFIX + (event.error_message or _NO_MSG)
                     print(f"  ERROR: {error_msg}")
-                    final_response_text = f"AGENT_ERROR: {error_msg}" # Propagate error
+                    final_response_text = _AGENT_ERROR_PREFIX + error_msg # Propagate error
                 break # Stop processing events once final response or escalation found
 
             # Handle explicit escalation before final response
-            elif event.actions and event.actions.escalate:
-                 error_msg = f"Agent escalated before final response: {event.error_message or 'No specific message.'}"
+            elif escalated:
+                 error_msg = _ESCALATE_EARLY_PREFIX + (event.error_message or _NO_MSG)
                  print(f"  ERROR: {error_msg}")
-                 final_response_text = f"AGENT_ERROR: {error_msg}" # Propagate error
+                 final_response_text = _AGENT_ERROR_PREFIX + error_msg # Propagate error
                  break # Stop processing events
 
     except Exception as e:
          print(f"Exception during ADK run_async for agent '{agent_to_run.name}' for user '{user_id}': {e}")
-         final_response_text = f"ADK_RUNTIME_ERROR: {e}" # Propagate exception message
+         final_response_text = _ADK_RUNTIME_ERROR_PREFIX + str(e) # Propagate exception message
     finally:
-         # --- Restore the original environment variable ---
-         if api_key:
-             if original_api_key_env is None:
-                 del os.environ["GOOGLE_API_KEY"]
-             else:
-                 os.environ["GOOGLE_API_KEY"] = original_api_key_env
-             # print("Restored original GOOGLE_API_KEY environment variable.")
+         # --- Close the event stream ---
+         # Breaking out of async for leaves the generator suspended with its HTTP/SSE stream
+         # open until garbage collection; aclose() stops generation now. A no-op if exhausted.
+         if events is not None:
+             try:
+                 await events.aclose()
+             except Exception as close_err:
+                 print(f"Warning: Failed to close the event stream of session '{session_id}': {close_err}")
+
+         # --- Unbind the per-run client ---
+         _request_genai_client.reset(client_token)
 
          # Clean up the temporary session
          try:
-             # It's safer to check if the session exists before deleting
-             if session_service_instance.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id):
-                 session_service_instance.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
-                 # print(f"Cleaned up session '{session_id}'.")
-             # else:
-                  # print(f"Temporary session '{session_id}' not found for cleanup (might have failed early).")
+             # Delete directly; a session that was never created (early failure) is
+             # ignored by the session service or caught below.
+             session_service_instance.delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
          except Exception as delete_err:
              print(f"Warning: Failed to delete temporary session '{session_id}': {delete_err}")
 
     # print(f"Agent '{agent_to_run.name}' finished for user '{user_id}'. Result: {'<empty>' if not final_response_text else final_response_text[:100] + '...'}")
+    if (cache_key and final_response_text
+            and not final_response_text.startswith((_AGENT_ERROR_PREFIX, _ADK_RUNTIME_ERROR_PREFIX))
+            and (cache_check is None or cache_check(final_response_text))):
+        llm_cache.set(cache_key, final_response_text, cache_ttl)
     return final_response_text
 
 
 # Export necessary items
 __all__ = [
     "session_service",
+    "ContextKeyGemini",
     "is_valid_svg",
+    "looks_like_svg_prefix",
+    "inject_font_awesome_styles",
+    "minify_svg",
+    "compact_markdown",
+    "genai_client_for_key",
+    "LLMCache",
+    "llm_cache",
     "run_adk_interaction", # Export the modified function
     "encrypt_api_key", # Export encryption/decryption helpers
     "decrypt_api_key",
@@ -1,182 +1,274 @@
 # api_handler.py
 import asyncio
+import atexit
+import heapq
+import itertools
 import os
-import uuid
+import time
 import logging
+import logging.handlers
+import queue
+from collections import deque
 from random import shuffle
 from dotenv import load_dotenv
-import datetime # Import datetime
-import pytz # For timezone-aware datetimes
 
 from google.genai import types as google_genai_types
 from google.adk.agents import Agent
 
 import agents
 import adk_utils
+from semantic_cache import ExactResponseCache, SemanticCache
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# --- Off-loop log output ---
+# acquire/release log on every request. Records are only enqueued on the event loop thread;
+# a listener thread hands them to the root logger's handlers, so their I/O never stalls the loop.
+class _RootLoggerHandler(logging.Handler):
+    """Dispatches records to the root logger's handlers, whatever they are when the record arrives."""
+    def emit(self, record):
+        logging.getLogger().handle(record)
+
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False # The listener forwards to the root handlers instead
+_log_listener = logging.handlers.QueueListener(_log_queue, _RootLoggerHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop) # Flush queued records on shutdown
+
 # --- Configuration for the Project Pool ---
 num_projects_str = os.getenv('NUM_PROJECTS')
 DEFAULT_NUM_PROJECTS = 6 # As you mentioned you have 6 now
 CLIENT_IMPOSED_SESSIONS_PER_KEY_PER_MINUTE = 3 # Client's new requirement
+RATE_LIMIT_WINDOW_SECONDS = 60.0 # Period over which a key's new-session budget fully refills
 
 if num_projects_str is None:
-    logging.warning(f"NUM_PROJECTS environment variable not set. Defaulting to {DEFAULT_NUM_PROJECTS}.")
+    logger.warning("NUM_PROJECTS environment variable not set. Defaulting to %s.", DEFAULT_NUM_PROJECTS)
     NUM_PROJECTS = DEFAULT_NUM_PROJECTS
 else:
     try:
         NUM_PROJECTS = int(num_projects_str)
         if NUM_PROJECTS <= 0:
-            logging.warning(f"NUM_PROJECTS in .env ('{num_projects_str}') is not positive. Defaulting to {DEFAULT_NUM_PROJECTS}.")
+            logger.warning("NUM_PROJECTS in .env ('%s') is not positive. Defaulting to %s.", num_projects_str, DEFAULT_NUM_PROJECTS)
             NUM_PROJECTS = DEFAULT_NUM_PROJECTS
     except ValueError:
-        logging.warning(f"NUM_PROJECTS environment variable ('{num_projects_str}') is not a valid integer. Defaulting to {DEFAULT_NUM_PROJECTS}.")
+        logger.warning("NUM_PROJECTS environment variable ('%s') is not a valid integer. Defaulting to %s.", num_projects_str, DEFAULT_NUM_PROJECTS)
         NUM_PROJECTS = DEFAULT_NUM_PROJECTS
 
 MAX_CONCURRENT_REQUESTS_PER_KEY = 3 # Simultaneous active users per key
+MAX_POOL_SHARDS = 4 # Sub-pools the keys are split into; each user prefers one (see acquire_project)
+API_KEY_ENV_PREFIX = "GOOGLE_API_KEY_"
 API_KEYS = []
 
+# One pass over the environment collects every GOOGLE_API_KEY_<n>, instead of a lookup per index
+pooled_keys_by_index = {
+    int(name[len(API_KEY_ENV_PREFIX):]): value
+    for name, value in os.environ.items()
+    if name.startswith(API_KEY_ENV_PREFIX) and name[len(API_KEY_ENV_PREFIX):].isdigit()
+}
 for i in range(NUM_PROJECTS):
-    key = os.getenv(f"GOOGLE_API_KEY_{i}")
+    key = pooled_keys_by_index.get(i)
     if not key:
-        logging.warning(f"Missing GOOGLE_API_KEY_{i} in .env file. This key will not be part of the pool.")
+        logger.warning("Missing GOOGLE_API_KEY_%s in .env file. This key will not be part of the pool.", i)
     else:
         API_KEYS.append(key)
 
 if not API_KEYS:
-    logging.error("FATAL: No GOOGLE_API_KEY_i found for the api_handler pool. System will not function for pooled keys.")
+    logger.error("FATAL: No GOOGLE_API_KEY_i found for the api_handler pool. System will not function for pooled keys.")
     # Consider raising an exception or exiting if no keys are loaded for the pool.
 
-logging.info(f"api_handler: Loaded {len(API_KEYS)} API Keys. Target NUM_PROJECTS: {NUM_PROJECTS}.")
-logging.info(f"api_handler: Max concurrent users per key: {MAX_CONCURRENT_REQUESTS_PER_KEY}.")
-logging.info(f"api_handler: Max new user sessions initiating per key per minute: {CLIENT_IMPOSED_SESSIONS_PER_KEY_PER_MINUTE}.")
+logger.info("api_handler: Loaded %s API Keys. Target NUM_PROJECTS: %s.", len(API_KEYS), NUM_PROJECTS)
+logger.info("api_handler: Max concurrent users per key: %s.", MAX_CONCURRENT_REQUESTS_PER_KEY)
+logger.info("api_handler: Max new user sessions initiating per key per minute: %s.", CLIENT_IMPOSED_SESSIONS_PER_KEY_PER_MINUTE)
+
+
+class PooledProject:
+    """One pooled API key and its concurrency/rate-limit state (slots: read on every acquire)."""
+    __slots__ = ("api_key", "id", "semaphore", "rate_limit", "session_starts", "genai_client", "shard")
+
+    def __init__(self, api_key: str, project_id: str):
+        self.api_key = api_key
+        self.id = project_id
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS_PER_KEY)
+        self.rate_limit = CLIENT_IMPOSED_SESSIONS_PER_KEY_PER_MINUTE # New sessions allowed per rate window
+        # Start times (monotonic) of the sessions opened within the last rate window, oldest first
+        self.session_starts = deque()
+        self.genai_client = None # Built in initialize_project_pool
+        self.shard = 0 # Index into available_project_shards
 
 
 PROJECT_POOL = []
 if API_KEYS:
     PROJECT_POOL = [
-        {
-            "api_key": API_KEYS[i],
-            "id": f"pooled_project_{i+1}", # 1-based id
-            "semaphore": asyncio.Semaphore(MAX_CONCURRENT_REQUESTS_PER_KEY),
-            "session_start_timestamps": [], # Stores datetime objects of when sessions started
-            # Storing the limit here for clarity, could be a global constant too
-            "rate_limit_new_sessions_per_minute": CLIENT_IMPOSED_SESSIONS_PER_KEY_PER_MINUTE
-        }
+        PooledProject(API_KEYS[i], f"pooled_project_{i+1}") # 1-based id
         for i in range(len(API_KEYS))
     ]
     shuffle(PROJECT_POOL) # Shuffle for initial load distribution
 
-available_projects_queue = asyncio.Queue()
+# Free project tokens, split round-robin into shards. Each shard is a min-heap of
+# (-new sessions left in the window, release time, tiebreak, token): the project with the most rate
+# budget left, then the longest-idle one, is tried first. Only touched between awaits, so the event loop serializes access
+# and no lock is needed.
+POOL_SHARD_COUNT = max(1, min(MAX_POOL_SHARDS, len(PROJECT_POOL)))
+for i, project_token in enumerate(PROJECT_POOL):
+    project_token.shard = i % POOL_SHARD_COUNT
+available_project_shards = [[] for _ in range(POOL_SHARD_COUNT)]
+_heap_tiebreak = itertools.count() # Keeps heap entries comparable without comparing the tokens
+# Set whenever a token is released, to wake acquirers waiting for a usable project
+project_released_event = asyncio.Event()
+
+
+def _session_budget(project_token, now):
+    """
+    Drops session starts that left the sliding rate window and returns how many new sessions
+    the project may still open in it. A strict window (not a token bucket), so no 60s span
+    ever holds more than rate_limit sessions.
+    """
+    session_starts = project_token.session_starts
+    window_start = now - RATE_LIMIT_WINDOW_SECONDS
+    while session_starts and session_starts[0] <= window_start:
+        session_starts.popleft()
+    return project_token.rate_limit - len(session_starts)
+
+
+def _push_available_project(project_token):
+    """Returns a token to its shard's heap, keyed by its current rate budget."""
+    now = time.monotonic()
+    heapq.heappush(available_project_shards[project_token.shard], (
+        -_session_budget(project_token, now), now, next(_heap_tiebreak), project_token
+    ))
+
+
+def _pop_usable_project(available_projects_heap):
+    """
+    Pops the best token in a shard's heap that is under its new-session rate limit.
+    Returns (token, None), or (None, earliest monotonic time a rate-limited token frees up)
+    if none is usable right now (None, None if the heap is empty). Tokens in use are out of
+    the heap until released, so every token here has a free concurrency slot.
+    """
+    # Monotonic clock: cheap float arithmetic, and immune to wall-clock adjustments
+    now = time.monotonic()
+    rate_limited = []
+    usable_token = None
+    while available_projects_heap:
+        entry = heapq.heappop(available_projects_heap)
+        project_token = entry[-1]
+        if _session_budget(project_token, now) > 0:
+            usable_token = project_token
+            break
+        rate_limited.append(entry)
+
+    for entry in rate_limited: # Skipped tokens go back untouched
+        heapq.heappush(available_projects_heap, entry)
+    if usable_token:
+        return usable_token, None
+    if not rate_limited:
+        return None, None
+    # A rate-limited project frees up when its oldest session start leaves the window
+    return None, min(entry[-1].session_starts[0] for entry in rate_limited) + RATE_LIMIT_WINDOW_SECONDS
+
 
 async def initialize_project_pool():
     if not PROJECT_POOL:
-        logging.warning("api_handler: Project pool is empty (no API keys loaded). Pooled keys unavailable.")
+        logger.warning("api_handler: Project pool is empty (no API keys loaded). Pooled keys unavailable.")
         return
 
     for project_token in PROJECT_POOL:
-        await available_projects_queue.put(project_token)
-    logging.info(f"api_handler: Project pool initialized. {available_projects_queue.qsize()} project tokens available in queue.")
+        # Build each key's genai client (and its connection pool) up front, not on the first request
+        project_token.genai_client = adk_utils.genai_client_for_key(project_token.api_key)
+        _push_available_project(project_token)
+    logger.info("api_handler: Project pool initialized. %s project tokens available in %s shards.", len(PROJECT_POOL), POOL_SHARD_COUNT)
 
     current_vertex_setting = os.getenv("GOOGLE_GENAI_USE_VERTEXAI", "True").lower()
     if current_vertex_setting != "false":
-        logging.info(f"api_handler: Setting GOOGLE_GENAI_USE_VERTEXAI to 'False'. Was: '{os.getenv('GOOGLE_GENAI_USE_VERTEXAI')}'")
+        logger.info("api_handler: Setting GOOGLE_GENAI_USE_VERTEXAI to 'False'. Was: '%s'", os.getenv('GOOGLE_GENAI_USE_VERTEXAI'))
         os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "False"
     else:
-        logging.info(f"api_handler: GOOGLE_GENAI_USE_VERTEXAI is already 'False'.")
+        logger.info("api_handler: GOOGLE_GENAI_USE_VERTEXAI is already 'False'.")
 
 
-async def acquire_project():
+def _pop_usable_project_for(user_id):
+    """
+    Tries the user's home shard (picked by hash(user_id)) first and the other shards only if
+    it has nothing usable. Same return values as _pop_usable_project, across all shards.
+    """
+    home_shard = hash(user_id) % POOL_SHARD_COUNT
+    next_eligible_at = None
+    for offset in range(POOL_SHARD_COUNT):
+        project_token, eligible_at = _pop_usable_project(available_project_shards[(home_shard + offset) % POOL_SHARD_COUNT])
+        if project_token is not None:
+            return project_token, None
+        if eligible_at is not None and (next_eligible_at is None or eligible_at < next_eligible_at):
+            next_eligible_at = eligible_at
+    return None, next_eligible_at
+
+
+async def acquire_project(user_id=None):
     """
     Acquires an available project from the pool that meets BOTH concurrency
     and the new session rate limit. Waits if no such project is available.
+    Projects from user_id's home shard are preferred, which spreads concurrent users over
+    separate heaps and keeps a user's requests on the same few keys.
     """
     if not PROJECT_POOL:
-        logging.error("api_handler: Project pool is empty. Cannot acquire project.")
+        logger.error("api_handler: Project pool is empty. Cannot acquire project.")
         # This indicates a setup issue if initialize_project_pool didn't populate it.
         raise Exception("api_handler: Project pool is not configured or empty.")
 
-    attempt_cycle = 0
     while True: # Loop until a suitable project is acquired
-        # logging.debug(f"acquire_project: Attempt cycle {attempt_cycle}. Queue size: {available_projects_queue.qsize()}")
-        if available_projects_queue.empty():
-            logging.info("acquire_project: Queue is empty, waiting for a project token...")
-            # This await will block until a project is put back by release_project
-            # Potentially add a timeout here if you want to give up after a certain wait.
-
-        project_token = await available_projects_queue.get()
-        project_id_log = project_token['id'] # For logging before full acquisition
-
-        # Ensure we use timezone-aware UTC for comparisons
-        now_utc = datetime.datetime.now(pytz.utc)
-
-        # 1. Prune old timestamps (older than 60 seconds) from this specific project_token
-        project_token["session_start_timestamps"] = [
-            ts for ts in project_token["session_start_timestamps"]
-            if (now_utc - ts).total_seconds() < 60
-        ]
-        current_sessions_in_rate_window = len(project_token["session_start_timestamps"])
-
-        # 2. Check the new session rate limit
-        if current_sessions_in_rate_window < project_token["rate_limit_new_sessions_per_minute"]:
-            # Rate limit check passed for initiating a *new* session.
-            # Now, try to acquire the concurrency semaphore.
-            # logging.debug(f"acquire_project: Project {project_id_log} passed rate limit ({current_sessions_in_rate_window}/{project_token['rate_limit_new_sessions_per_minute']}). Trying semaphore.")
+        project_token, next_eligible_at = _pop_usable_project_for(user_id)
+        if project_token is None:
+            # Nothing usable: sleep until a token is released or, if some are only rate-limited,
+            # until the earliest of them frees up. No await since the heap scan, so no release
+            # can be missed by clearing here.
+            project_released_event.clear()
+            timeout = None if next_eligible_at is None else max(next_eligible_at - time.monotonic(), 0.0)
+            if next_eligible_at is None:
+                logger.info("acquire_project: No project tokens available, waiting for a release...")
+            else:
+                logger.debug("api_handler: All available projects are rate-limited. Waiting up to %.2fs.", timeout)
             try:
-                # Attempt to acquire the semaphore. This will block if the key
-                # is already at its MAX_CONCURRENT_REQUESTS_PER_KEY limit.
-                # Add a small timeout to prevent indefinite blocking on just one key's semaphore
-                # if other keys might be available and not rate-limited.
-                # However, the primary waiting should be on available_projects_queue.get()
-                # For now, let's allow it to block on the semaphore as per original design.
-                await project_token["semaphore"].acquire()
-
-                # If we reach here, semaphore acquired! This key can handle another concurrent user.
-                # Add current time to mark the start of this new session for rate-limiting.
-                project_token["session_start_timestamps"].append(now_utc)
-                logging.info(f"api_handler: Acquired project {project_token['id']}. Concurrency slot taken. New session started at {now_utc.isoformat()}. Sessions in last 60s for this key: {len(project_token['session_start_timestamps'])}.")
-                return project_token # Successfully acquired!
-            except Exception as e: # Should not happen with standard semaphore acquire unless cancelled
-                logging.error(f"api_handler: Unexpected error acquiring semaphore for {project_id_log}: {e}", exc_info=True)
-                # If semaphore acquisition fails unexpectedly, put token back and try another.
-                await available_projects_queue.put(project_token)
-                # Continue loop to try another project or wait on queue.
-        else:
-            # This project_token is currently rate-limited for *new sessions*.
-            # logging.info(f"api_handler: Project {project_id_log} is rate-limited for new sessions ({current_sessions_in_rate_window}/{project_token['rate_limit_new_sessions_per_minute']} in last 60s). Returning to queue.")
-            await available_projects_queue.put(project_token) # Put it back at the end of the queue.
-
-        # If we've cycled through all available project tokens once and none were suitable,
-        # it means all are either rate-limited or their semaphores are full (and we didn't wait on a specific one).
-        # The `await available_projects_queue.get()` at the start of the loop will naturally cause a wait
-        # if the queue becomes empty.
-        # To prevent extremely fast spinning if all keys are rate-limited but semaphores are free:
-        attempt_cycle +=1
-        # Heuristic: if we check more than the number of projects without success, pause briefly.
-        # This helps if all projects are temporarily rate-limited.
-        if available_projects_queue.qsize() < len(PROJECT_POOL) and attempt_cycle > len(PROJECT_POOL) * 2 : # Avoid tight loop when many items are in queue but all fail checks
-             logging.debug(f"api_handler: Cycled through projects; all appear busy or rate-limited. Brief pause. Attempt cycle: {attempt_cycle}")
-             await asyncio.sleep(0.2) # Short pause to yield control and allow time to pass for rate limits
-             attempt_cycle = 0 # Reset cycle count
-
-
-async def release_project(project_token):
-    """Releases a project's concurrency semaphore slot and returns its token to the pool."""
+                await asyncio.wait_for(project_released_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        project_id_log = project_token.id
+        try:
+            # Taken tokens are out of the heap until released, so this normally does not block
+            await project_token.semaphore.acquire()
+
+            # Semaphore acquired! Record the new session in the key's rate window.
+            project_token.session_starts.append(time.monotonic())
+            logger.info("api_handler: Acquired project %s. Concurrency slot taken. New sessions in the current window for this key: %s/%s.", project_id_log, len(project_token.session_starts), project_token.rate_limit)
+            return project_token # Successfully acquired!
+        except Exception as e: # Should not happen with standard semaphore acquire unless cancelled
+            logger.error("api_handler: Unexpected error acquiring semaphore for %s: %s", project_id_log, e, exc_info=True)
+            # If semaphore acquisition fails unexpectedly, put token back and try another.
+            _push_available_project(project_token)
+            project_released_event.set()
+
+
+def release_project(project_token):
+    """
+    Releases a project's concurrency semaphore slot and returns its token to the pool.
+    Nothing here waits, so it is a plain function: callers do not await it.
+    """
     if project_token:
         try:
-            project_token["semaphore"].release()
-            # The session_start_timestamps are managed at acquisition and by pruning.
-            # No change needed here for timestamps upon release for this model.
-            logging.info(f"api_handler: Project {project_token['id']} concurrency slot released.")
+            project_token.semaphore.release()
+            # The rate budget is spent at acquisition and frees up as the window slides, not on release.
+            logger.info("api_handler: Project %s concurrency slot released.", project_token.id)
         except Exception as e:
-            logging.error(f"api_handler: Error releasing semaphore for {project_token.get('id', 'UNKNOWN')}: {e}", exc_info=True)
+            logger.error("api_handler: Error releasing semaphore for %s: %s", project_token.id, e, exc_info=True)
         finally:
-            # Always try to put the token back in the queue, even if semaphore release failed (though it shouldn't)
-            await available_projects_queue.put(project_token)
-            # logging.debug(f"api_handler: Project {project_token['id']} token returned to queue. Queue size: {available_projects_queue.qsize()}")
+            # Always put the token back, even if semaphore release failed (though it shouldn't)
+            _push_available_project(project_token)
+            project_released_event.set()
     else:
-        logging.warning("api_handler: Attempted to release a null project_token.")
+        logger.warning("api_handler: Attempted to release a null project_token.")
 
 
 # process_request_with_pooled_key remains unchanged as app.py now handles acquire/release
@@ -186,6 +278,43 @@ async def release_project(project_token):
 # For your current app.py structure (where app.py calls acquire_project once),
 # process_request_with_pooled_key is not directly used in that flow.
 
+# --- Response cache for single-step calls ---
+# Repeated text-only prompts to the same agent are answered from memory, without taking a
+# pooled key at all. Only text-answer agents (answer, decision) also match near-identical
+# prompts: for the SVG and brief agents a one-word difference ("blue" vs "green login
+# screen") changes the output, so they match exact prompts only.
+RESPONSE_CACHE_SIMILARITY = 0.95
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+RESPONSE_CACHE_TTL_SECONDS = 3600
+_response_caches = {} # agent name -> SemanticCache or ExactResponseCache
+
+_request_log_counter = itertools.count() # Request ids are only for correlating log lines
+
+
+def _response_cache_for(agent_name):
+    cache = _response_caches.get(agent_name)
+    if cache is None:
+        if agent_name in (agents.answer_agent.name, agents.decision_agent.name):
+            cache = SemanticCache(
+                similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+                max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                namespace=agent_name,
+            )
+        else:
+            cache = ExactResponseCache(agent_name, max_entries=RESPONSE_CACHE_MAX_ENTRIES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS)
+        _response_caches[agent_name] = cache
+    return cache
+
+
+def _cacheable_prompt(user_content):
+    """Returns the prompt text of text-only content, or None (images etc. make it uncacheable)."""
+    parts = user_content.parts or []
+    if not parts or any(part.text is None for part in parts):
+        return None
+    return "\n".join(part.text for part in parts)
+
+
 async def process_request_with_pooled_key_single_step( # Renamed for clarity if used elsewhere
     agent_to_run: Agent,
     user_content: google_genai_types.Content,
@@ -196,44 +325,55 @@ async def process_request_with_pooled_key_single_step( # Renamed for clarity if
     respecting concurrency and new session rate limits, running the ADK interaction,
     and then releasing the key.
     Each call to this function is treated as a new "session" for rate limiting.
+    Text-only requests are served from a per-agent response cache when possible.
     """
     project_in_use = None
-    request_log_id = str(uuid.uuid4())[:8]
+    request_log_id = next(_request_log_counter) & 0xFFFFFFFF # Logged as 8 hex digits (%08x)
+    agent_name = agent_to_run.name
+
+    prompt_text = _cacheable_prompt(user_content)
+    response_cache = _response_cache_for(agent_name) if prompt_text else None
+    if response_cache:
+        cached_response = await asyncio.to_thread(response_cache.lookup, prompt_text)
+        if cached_response:
+            logger.info("api_handler [Req-%08x]: Agent '%s' served from response cache.", request_log_id, agent_name)
+            return cached_response
 
     if not PROJECT_POOL:
-        logging.error(f"api_handler [Req-{request_log_id}]: Cannot process. Project pool is empty.")
+        logger.error("api_handler [Req-%08x]: Cannot process. Project pool is empty.", request_log_id)
         return f"ADK_RUNTIME_ERROR: api_handler: Project pool is empty or not configured."
 
     try:
         # This acquire_project now embodies the new rate limiting logic too
-        project_in_use = await acquire_project()
-        pooled_api_key = project_in_use["api_key"]
-        # print("here is the api key", pooled_api_key) # Your debug print
-        project_id_log_tag = f"{project_in_use['id']}/Req-{request_log_id}"
+        project_in_use = await acquire_project(user_id)
+        project_id = project_in_use.id
 
-        logging.info(f"api_handler [{project_id_log_tag}]: Using pooled key ...{pooled_api_key[-4:]} for agent '{agent_to_run.name}' for user '{user_id}'.")
+        if logger.isEnabledFor(logging.INFO): # Only slice the key when it is logged
+            logger.info("api_handler [%s/Req-%08x]: Using pooled key ...%s for agent '%s' for user '%s'.", project_id, request_log_id, project_in_use.api_key[-4:], agent_name, user_id)
 
         response = await adk_utils.run_adk_interaction(
             agent_to_run=agent_to_run,
             user_content=user_content,
             session_service_instance=adk_utils.session_service,
             user_id=user_id,
-            api_key=pooled_api_key
+            genai_client=project_in_use.genai_client # Prebuilt in initialize_project_pool
         )
-        logging.info(f"api_handler [{project_id_log_tag}]: Agent '{agent_to_run.name}' completed.")
+        logger.info("api_handler [%s/Req-%08x]: Agent '%s' completed.", project_id, request_log_id, agent_name)
+        if response_cache and response and not response.startswith(("AGENT_ERROR:", "ADK_RUNTIME_ERROR:")):
+            await asyncio.to_thread(response_cache.store, prompt_text, response)
         return response
     except Exception as e:
-        project_id_for_error = project_in_use['id'] if project_in_use else 'N/A_NO_PROJECT_ACQUIRED'
-        logging.error(f"api_handler [{project_id_for_error}/Req-{request_log_id}]: Error in process_request_with_pooled_key_single_step for '{agent_to_run.name}': {e}", exc_info=True)
-        return f"ADK_RUNTIME_ERROR: Exception in api_handler processing request for '{agent_to_run.name}': {e}"
+        project_id_for_error = project_in_use.id if project_in_use else 'N/A_NO_PROJECT_ACQUIRED'
+        logger.error("api_handler [%s/Req-%08x]: Error in process_request_with_pooled_key_single_step for '%s': %s", project_id_for_error, request_log_id, agent_name, e, exc_info=True)
+        return f"ADK_RUNTIME_ERROR: Exception in api_handler processing request for '{agent_name}': {e}"
     finally:
         if project_in_use:
-            # This release_project just releases the semaphore and returns token to queue
-            await release_project(project_in_use)
-            # logging.info(f"api_handler [{project_in_use['id']}/Req-{request_log_id}]: Released project {project_in_use['id']} after single step.")
+            # This release_project just releases the semaphore and returns the token to the pool
+            release_project(project_in_use)
 
 
 __all__ = [
+    "PooledProject",
     "initialize_project_pool",
     "acquire_project", # Exporting for app.py
     "release_project", # Exporting for app.py
@@ -3,29 +3,93 @@ import base64
 import asyncio
 import json
 import logging
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, jsonify
+from quart.json.provider import DefaultJSONProvider
 from google.genai import types as google_genai_types
 import config
 import adk_utils
 import agents
 import firebase_admin_init
 import api_handler # We will use acquire_project and release_project from here
+import decision_classifier
+from semantic_cache import answer_cache, brief_cache
 # import datetime # Not directly used in snippet
-# import pytz # Not directly used in snippet
-# import traceback # Not directly used in snippet, Flask handles top-level
+# import traceback # Not directly used in snippet, Quart handles top-level
 import re
-from tools import replace_svg_image_links_with_base64
-
-# --- Flask App Setup ---
-app = Flask(__name__)
-CORS(app, origins="*")
+import tools # Request-scoped lookup cache
+from tools import replace_svg_image_links_with_base64, shrink_image_for_vision
+
+try:
+    import orjson # Optional: faster request/response JSON (large base64 image payloads)
+except ImportError:
+    orjson = None
+
+# --- Quart App Setup ---
+# Quart (the asyncio port of the Flask API) runs every request as a task on the server's event
+# loop, so /generate's LLM awaits interleave and the pool/caches in api_handler and adk_utils
+# are shared by one loop. Blocking calls (Firebase, image work) go through asyncio.to_thread.
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson, used by request.get_json() and jsonify().
+    Types orjson does not handle natively fall back to the default conversions.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+app = Quart(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 logging.basicConfig(level=logging.INFO)
 
+# --- CORS ---
+# Any origin is allowed (the plugin UI runs in Figma's sandboxed iframe), so the headers are
+# constant: set them on every response and answer preflights before routing does any work.
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Headers": "Authorization, Content-Type",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Max-Age": "86400", # Browsers reuse a preflight result for a day
+}
+
+@app.before_request
+async def answer_cors_preflight():
+    if request.method == 'OPTIONS':
+        return '', 204
+
+@app.after_request
+async def add_cors_headers(response):
+    response.headers.update(CORS_HEADERS)
+    return response
+
 # --- Global State (Manual Chat History per user) ---
 chat_history = {}
 MAX_CHAT_HISTORY = 10
 
+# --- Modify-mode image sizes (max side, px) ---
+# The frame is only layout context, so it is sent as a small thumbnail (a single Gemini
+# image tile); the element being edited keeps enough resolution for detail.
+FRAME_IMAGE_MAX_DIM = 384
+ELEMENT_IMAGE_MAX_DIM = 1024
+
+# --- Exact response cache TTLs (adk_utils.llm_cache) ---
+# Intent routing is stable, so identical decision requests are reused for a day; generated
+# SVGs for an identical brief/selection for an hour. Answers are never cached here: they
+# come from google_search and must stay fresh.
+DECISION_CACHE_TTL_SECONDS = 24 * 3600
+SVG_CACHE_TTL_SECONDS = 3600
+INTENT_LABELS = frozenset(('create', 'modify', 'answer'))
+
+def is_intent_label(text):
+    """True if the decision agent's reply is one of the known intents."""
+    return text.strip().lower() in INTENT_LABELS
+
 # --- Utility to extract and verify UID from request (for AI requests) ---
 def get_user_uid_from_request(request):
     """Extracts and verifies the Firebase ID token from the Authorization header."""
@@ -43,24 +107,60 @@ def get_user_uid_from_request(request):
         return None, "Authentication failed: Invalid or expired token. Please sign in again."
     return uid, None
 
+# --- Run an SVG agent cascade (create/modify) ---
+async def run_svg_agent_cascade(agent_tiers, content, uid, api_key):
+    """
+    Runs the agents in agent_tiers (cheapest first) until one returns valid SVG and returns
+    the cleaned SVG. Raises ValueError with the last failure if every tier fails.
+    """
+    error_message = None
+    for agent in agent_tiers:
+        svg_response = await adk_utils.run_adk_interaction(
+            agent, content, adk_utils.session_service,
+            user_id=uid, api_key=api_key, # Use the held key
+            partial_text_check=adk_utils.looks_like_svg_prefix, # Stream and stop early on non-SVG output
+            cache_ttl=SVG_CACHE_TTL_SECONDS, cache_check=adk_utils.is_valid_svg # Never replay invalid SVG
+        )
+        if not svg_response or svg_response.startswith("AGENT_ERROR:") or svg_response.startswith("ADK_RUNTIME_ERROR:"):
+            error_message = f"Agent '{agent.name}' failed or returned error: {svg_response}"
+        else:
+            cleaned_svg = adk_utils.is_valid_svg(svg_response)
+            if cleaned_svg:
+                return cleaned_svg
+            error_message = f"Agent '{agent.name}' response is not valid SVG. Snippet: {str(svg_response)[:200]}..."
+        if agent is not agent_tiers[-1]:
+            logging.warning(f"UID {uid}: {error_message} Escalating to the next model tier.")
+    raise ValueError(error_message)
+
+# --- Final SVG post-processing ---
+def postprocess_svg(svg):
+    """
+    Minifies the agent's SVG, splices in the Font Awesome styles and inlines linked images
+    as base64. Parsing the SVG and downloading the images blocks, so callers run this in a
+    worker thread (asyncio.to_thread) to keep the event loop serving other requests.
+    """
+    svg = adk_utils.minify_svg(svg)
+    svg = adk_utils.inject_font_awesome_styles(svg)
+    return replace_svg_image_links_with_base64(svg)
+
 # --- AUTHENTICATION & KEY MANAGEMENT ENDPOINTS (Unchanged) ---
 @app.route('/auth/exchange-id-token-for-custom-token', methods=['POST'])
-def exchange_id_token_for_custom_token():
+async def exchange_id_token_for_custom_token():
     if not request.is_json:
         return jsonify({"success": False, "error": "Request must be JSON"}), 415
-    data = request.get_json()
+    data = await request.get_json()
     client_id_token = data.get('idToken')
     if not client_id_token:
         return jsonify({"success": False, "error": "Missing 'idToken' in request body"}), 400
     try:
-        decoded_token = firebase_admin_init.firebase_auth.verify_id_token(client_id_token, check_revoked=True)
+        decoded_token = await asyncio.to_thread(firebase_admin_init.firebase_auth.verify_id_token, client_id_token, check_revoked=True)
         uid = decoded_token['uid']
         email = decoded_token.get('email')
         logging.info(f"Client ID Token verified. User UID: {uid}")
-        firebase_admin_init.create_user_doc_if_not_exists(uid, email=email)
-        custom_token_bytes = firebase_admin_init.firebase_auth.create_custom_token(uid)
+        await asyncio.to_thread(firebase_admin_init.create_user_doc_if_not_exists, uid, email=email)
+        custom_token_bytes = await asyncio.to_thread(firebase_admin_init.firebase_auth.create_custom_token, uid)
         logging.info(f"Custom token minted for UID: {uid}")
-        has_api_key = firebase_admin_init.has_api_key_stored(uid)
+        has_api_key = await asyncio.to_thread(firebase_admin_init.has_api_key_stored, uid)
         logging.info(f"User {uid} has API key stored: {has_api_key}")
         return jsonify({
             "success": True,
@@ -81,20 +181,20 @@ def exchange_id_token_for_custom_token():
         return jsonify({"success": False, "error": "An internal error occurred during authentication."}), 500
 
 @app.route('/auth/set-api-key', methods=['POST'])
-def set_user_api_key():
+async def set_user_api_key():
     if not request.is_json:
         return jsonify({"success": False, "error": "Request must be JSON"}), 415
-    uid, auth_error = get_user_uid_from_request(request)
+    uid, auth_error = await asyncio.to_thread(get_user_uid_from_request, request)
     if auth_error:
         logging.warning(f"Authentication failed for /auth/set-api-key: {auth_error}")
         return jsonify({"success": False, "error": f"Authentication failed: {auth_error}"}), 401
-    data = request.get_json()
+    data = await request.get_json()
     api_key_from_user = data.get('apiKey')
     if not api_key_from_user or not isinstance(api_key_from_user, str):
         return jsonify({"success": False, "error": "Missing or invalid 'apiKey' in request body"}), 400
     if not re.match(r'^AIza[0-9A-Za-z_-]{35}$', api_key_from_user):
          logging.warning(f"User {uid} provided an API key that doesn't match typical Gemini format.")
-    success = firebase_admin_init.store_encrypted_api_key(uid, api_key_from_user)
+    success = await asyncio.to_thread(firebase_admin_init.store_encrypted_api_key, uid, api_key_from_user)
     if success:
         return jsonify({"success": True, "message": "API key saved successfully. You now have unlimited access!"}), 200
     else:
@@ -103,21 +203,24 @@ def set_user_api_key():
 # --- AI GENERATION ENDPOINT (Modified for pooled key handling) ---
 @app.route('/generate', methods=['POST'])
 async def handle_generate():
-    if not request.is_json:
-        return jsonify({"success": False, "error": "Request must be JSON"}), 415
+    # Modify requests may send the images as raw multipart file fields instead of base64 JSON
+    is_multipart = request.mimetype == 'multipart/form-data'
+    if not request.is_json and not is_multipart:
+        return jsonify({"success": False, "error": "Request must be JSON or multipart/form-data"}), 415
 
-    uid, auth_error = get_user_uid_from_request(request)
+    uid, auth_error = await asyncio.to_thread(get_user_uid_from_request, request) # Token verification may hit the network
     if auth_error:
         logging.warning(f"Authentication/Authorization failed for /generate: {auth_error}")
         return jsonify({"success": False, "error": f"Authentication failed: {auth_error}"}), 401
     logging.info(f"/generate request from authenticated user UID: {uid}")
+    tools.start_request_cache() # Dedupe repeated Pixabay/image lookups within this request
 
-    can_proceed_trial, trial_message, decrypted_user_api_key, requests_today = firebase_admin_init.process_daily_trial(uid)
+    can_proceed_trial, trial_message, decrypted_user_api_key, requests_today = await asyncio.to_thread(firebase_admin_init.process_daily_trial, uid)
 
     run_interaction_method = None
     # api_key_for_adk_utils will be set either to user's key or a specific pooled key
     api_key_for_this_entire_request = None
-    # project_in_use_for_this_request will hold the dict from api_handler if a pooled key is used
+    # project_in_use_for_this_request will hold the api_handler.PooledProject if a pooled key is used
     project_in_use_for_this_request = None
 
     if decrypted_user_api_key:
@@ -133,11 +236,21 @@ async def handle_generate():
         return jsonify({"success": False, "error": trial_message, "mode": "trial_expired"}), 200
 
     user_history = chat_history.get(uid, [])
-    data = request.get_json()
+    if is_multipart:
+        # Text fields in request.form ('context' JSON-encoded), PNGs as the 'frame'/'element' files
+        data, files = await request.form, await request.files
+        context = app.json.loads(data['context']) if data.get('context') else {}
+        frame_file, element_file = files.get('frame'), files.get('element')
+        frame_image_bytes = frame_file.read() if frame_file else None
+        element_image_bytes = element_file.read() if element_file else None
+        frame_data_base64 = element_data_base64 = None
+    else:
+        data = await request.get_json()
+        context = data.get('context', {})
+        frame_data_base64 = data.get('frameDataBase64')
+        element_data_base64 = data.get('elementDataBase64')
+        frame_image_bytes = element_image_bytes = None
     user_prompt_text = data.get('userPrompt')
-    context = data.get('context', {})
-    frame_data_base64 = data.get('frameDataBase64')
-    element_data_base64 = data.get('elementDataBase64')
     i_mode = data.get('mode')
 
     if not user_prompt_text:
@@ -152,10 +265,9 @@ async def handle_generate():
         if user_history_summary:
             history_text = "Previous Conversation Summary:\n" + "\n---\n".join(user_history_summary) + "\n\n"
 
-    decision_prompt_text = f"{history_text}**User Request**\n{user_prompt_text}"
-    if context:
-        decision_prompt_text += f"\n**Figma Context**\n{json.dumps(context)}"
-    decision_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=decision_prompt_text)])
+    # Refine input only depends on the user prompt, so it can start before the intent is known
+    refine_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=user_prompt_text)])
+    svg_flow_task = None # Speculative create/modify run, see below
 
     final_result = None
     final_type = "unknown"
@@ -165,9 +277,9 @@ async def handle_generate():
         # --- Acquire pooled key if needed, ONCE for the entire request ---
         if run_interaction_method == 'pooled_key':
             try:
-                project_in_use_for_this_request = await api_handler.acquire_project()
-                api_key_for_this_entire_request = project_in_use_for_this_request["api_key"]
-                logging.info(f"UID {uid}: Acquired pooled project '{project_in_use_for_this_request['id']}' (key ...{api_key_for_this_entire_request[-4:]}) for this entire request.")
+                project_in_use_for_this_request = await api_handler.acquire_project(uid)
+                api_key_for_this_entire_request = project_in_use_for_this_request.api_key
+                logging.info(f"UID {uid}: Acquired pooled project '{project_in_use_for_this_request.id}' (key ...{api_key_for_this_entire_request[-4:]}) for this entire request.")
             except Exception as acquire_err:
                 logging.error(f"UID {uid}: Failed to acquire a pooled project: {acquire_err}", exc_info=True)
                 # If acquire fails, it might raise, or we might want to return a specific "busy" error.
@@ -178,12 +290,96 @@ async def handle_generate():
              logging.error(f"UID {uid}: Logical error - API key for the request was not set.")
              return jsonify({"success": False, "error": "Internal server error: API key not available for processing."}), 500
 
-        # --- 1. Determine Intent (using the single chosen API key) ---
-        agent_used_name_log = agents.decision_agent.name
-        intent_mode_raw = await adk_utils.run_adk_interaction(
-            agents.decision_agent, decision_content, adk_utils.session_service,
-            user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-        )
+        async def refine_with_cache():
+            # Near-duplicate prompts reuse a recent brief instead of re-running the refine agent
+            cached_brief = await asyncio.to_thread(brief_cache.lookup, user_prompt_text)
+            if cached_brief:
+                logging.info(f"UID {uid}: Design brief served from semantic cache.")
+                return cached_brief
+            brief = await adk_utils.run_adk_interaction(
+                agents.refine_agent, refine_content, adk_utils.session_service,
+                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
+            )
+            if brief and not brief.startswith(("AGENT_ERROR:", "ADK_RUNTIME_ERROR:")):
+                await asyncio.to_thread(brief_cache.store, user_prompt_text, brief)
+            return brief
+
+        async def run_create_flow():
+            """Refine -> create cascade. Returns the SVG; raises ValueError on failure."""
+            refined_prompt_md = await refine_with_cache()
+            if not refined_prompt_md or refined_prompt_md.startswith("AGENT_ERROR:") or refined_prompt_md.startswith("ADK_RUNTIME_ERROR:"):
+                raise ValueError(f"Refine Agent failed or returned error for create: {refined_prompt_md}")
+
+            refined_prompt_clean = adk_utils.compact_markdown(refined_prompt_md) # Fewer prefill tokens for the next agent
+            if not refined_prompt_clean:
+                 logging.warning(f"UID {uid}: Refine agent returned empty brief for create, falling back to original prompt.")
+                 refined_prompt_clean = user_prompt_text
+
+            create_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=refined_prompt_clean)])
+            return await run_svg_agent_cascade(
+                agents.create_agent_tiers, create_content, uid, api_key_for_this_entire_request
+            )
+
+        async def run_modify_flow():
+            """Refine -> modify cascade on the selected element. Returns the SVG; raises ValueError on failure."""
+            if not (frame_image_bytes or frame_data_base64) or not (element_image_bytes or element_data_base64) or not context.get('elementInfo'):
+                 raise ValueError("Missing frame image, element image, or 'elementInfo' for modify mode")
+
+            refined_prompt_md = await refine_with_cache()
+            if not refined_prompt_md or refined_prompt_md.startswith("AGENT_ERROR:") or refined_prompt_md.startswith("ADK_RUNTIME_ERROR:"):
+                raise ValueError(f"Refine Agent failed or returned error for modify: {refined_prompt_md}")
+
+            refined_prompt_clean = adk_utils.compact_markdown(refined_prompt_md) # Fewer prefill tokens for the next agent
+            if not refined_prompt_clean:
+                 logging.warning(f"UID {uid}: Refine agent returned empty brief for modify, falling back to original prompt.")
+                 refined_prompt_clean = user_prompt_text
+
+            modify_agent_prompt_text = f"""**Modification Brief**\n{refined_prompt_clean}\n\n**Original User Prompt for context:**\n{user_prompt_text}\n\n**Figma Context:**\nFrame Name: {context.get('frameName', 'N/A')}\nElement Info: {context.get('elementInfo','N/A')}"""
+            message_parts = [google_genai_types.Part(text=modify_agent_prompt_text)]
+            try:
+                frame_bytes = frame_image_bytes or base64.b64decode(frame_data_base64)
+                element_bytes = element_image_bytes or base64.b64decode(element_data_base64)
+            except Exception as e:
+                raise ValueError(f"Invalid image data received for modify mode: {e}")
+            # Resizing/encoding is CPU work, keep it off the event loop
+            frame_bytes, frame_mime = await asyncio.to_thread(shrink_image_for_vision, frame_bytes, FRAME_IMAGE_MAX_DIM)
+            element_bytes, element_mime = await asyncio.to_thread(shrink_image_for_vision, element_bytes, ELEMENT_IMAGE_MAX_DIM)
+            message_parts.append(google_genai_types.Part(inline_data=google_genai_types.Blob(mime_type=frame_mime, data=frame_bytes)))
+            message_parts.append(google_genai_types.Part(inline_data=google_genai_types.Blob(mime_type=element_mime, data=element_bytes)))
+
+            modify_content = google_genai_types.Content(role='user', parts=message_parts)
+            return await run_svg_agent_cascade(
+                agents.modify_agent_tiers, modify_content, uid, api_key_for_this_entire_request
+            )
+
+        svg_flows = {'create': run_create_flow, 'modify': run_modify_flow}
+
+        # --- Speculative create/modify flow ---
+        # A create/modify only proceeds when the intent matches the frontend selection (i_mode),
+        # so that flow (refine AND the SVG agent) starts concurrently with intent routing:
+        # latency is max(decision, flow) rather than their sum. The task is cancelled if the
+        # intent turns out to be anything else.
+        if i_mode in svg_flows:
+            svg_flow_task = asyncio.create_task(svg_flows[i_mode]())
+
+        # --- 1. Determine Intent (trusted frontend mode, local router, then the decision agent) ---
+        if i_mode in config.TRUSTED_CLIENT_MODES:
+            intent_mode_raw, resolved_by = i_mode, "frontend mode"
+        else:
+            intent_mode_raw, resolved_by = await decision_classifier.intent_router.route(user_prompt_text, i_mode)
+        if intent_mode_raw:
+            logging.info(f"UID {uid}: Intent '{intent_mode_raw}' resolved by {resolved_by}.")
+        else:
+            decision_prompt_text = f"{history_text}**User Request**\n{user_prompt_text}"
+            if context:
+                decision_prompt_text += f"\n**Figma Context**\n{json.dumps(context)}"
+            decision_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=decision_prompt_text)])
+            agent_used_name_log = agents.decision_agent.name
+            intent_mode_raw = await adk_utils.run_adk_interaction(
+                agents.decision_agent, decision_content, adk_utils.session_service,
+                user_id=uid, api_key=api_key_for_this_entire_request, # Use the held key
+                cache_ttl=DECISION_CACHE_TTL_SECONDS, cache_check=is_intent_label # Only cache usable labels
+            )
 
         if not intent_mode_raw or intent_mode_raw.startswith("AGENT_ERROR:") or intent_mode_raw.startswith("ADK_RUNTIME_ERROR:"):
             error_msg = f"Could not determine intent. Agent Response: {intent_mode_raw}"
@@ -197,6 +393,9 @@ async def handle_generate():
             intent_mode = 'answer'
         logging.info(f"UID {uid}: Determined Intent: '{intent_mode}'")
 
+        if intent_mode == 'answer' and svg_flow_task:
+            svg_flow_task.cancel() # Speculation missed; the answer flow does not need it
+
         if intent_mode in ['create', 'modify'] and i_mode != intent_mode:
             logging.warning(f"UID {uid}: Agent intent '{intent_mode}', frontend mode '{i_mode}'. Mismatch.")
             error_message_for_mismatch = ("I detected a creation request, but I need an empty frame selection to create a new design."
@@ -209,93 +408,38 @@ async def handle_generate():
             final_type = "svg"
             agent_used_name_log = f"{agents.refine_agent.name} -> {agents.create_agent.name}"
             logging.info(f"UID {uid}: --- Initiating Create Flow (using key ...{api_key_for_this_entire_request[-4:]}) ---")
-            refine_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=user_prompt_text)])
-            
-            refined_prompt_md = await adk_utils.run_adk_interaction(
-                agents.refine_agent, refine_content, adk_utils.session_service,
-                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-            )
-            if not refined_prompt_md or refined_prompt_md.startswith("AGENT_ERROR:") or refined_prompt_md.startswith("ADK_RUNTIME_ERROR:"):
-                raise ValueError(f"Refine Agent failed or returned error for create: {refined_prompt_md}")
-            
-            refined_prompt_clean = refined_prompt_md.strip()
-            # refined_prompt_clean = re.sub(r'^\s*```(?:markdown)?\s*', '', refined_prompt_clean, flags=re.IGNORECASE)
-            # refined_prompt_clean = re.sub(r'\s*```\s*$', '', refined_prompt_clean, flags=re.IGNORECASE)
-            if not refined_prompt_clean:
-                 logging.warning(f"UID {uid}: Refine agent returned empty brief for create, falling back to original prompt.")
-                 refined_prompt_clean = user_prompt_text
-            
-            create_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=refined_prompt_clean)])
-            initial_svg = await adk_utils.run_adk_interaction(
-                agents.create_agent, create_content, adk_utils.session_service,
-                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-            )
-            if not initial_svg or initial_svg.startswith("AGENT_ERROR:") or initial_svg.startswith("ADK_RUNTIME_ERROR:"):
-                raise ValueError(f"Create Agent failed or returned error: {initial_svg}")
-            
-            cleaned_svg = adk_utils.is_valid_svg(initial_svg)
-            if not cleaned_svg:
-                 raise ValueError(f"Create Agent response is not valid SVG. Snippet: {str(initial_svg)[:200]}...")
-            final_result = cleaned_svg
+            svg_flow_task = svg_flow_task or asyncio.create_task(run_create_flow())
+            final_result = await svg_flow_task
             logging.info(f"UID {uid}: Create flow successful.")
 
         elif intent_mode == 'modify':
             final_type = "svg"
             agent_used_name_log = f"{agents.refine_agent.name} -> {agents.modify_agent.name}"
             logging.info(f"UID {uid}: --- Initiating Modify Flow (using key ...{api_key_for_this_entire_request[-4:]}) ---")
-            if not frame_data_base64 or not element_data_base64 or not context.get('elementInfo'):
-                 raise ValueError("Missing 'frameDataBase64', 'elementDataBase64', or 'elementInfo' for modify mode")
-
-            refine_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=user_prompt_text)])
-            refined_prompt_md = await adk_utils.run_adk_interaction(
-                agents.refine_agent, refine_content, adk_utils.session_service,
-                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-            )
-            if not refined_prompt_md or refined_prompt_md.startswith("AGENT_ERROR:") or refined_prompt_md.startswith("ADK_RUNTIME_ERROR:"):
-                raise ValueError(f"Refine Agent failed or returned error for modify: {refined_prompt_md}")
-
-            refined_prompt_clean = refined_prompt_md.strip()
-            # refined_prompt_clean = re.sub(r'^\s*```(?:markdown)?\s*', '', refined_prompt_clean, flags=re.IGNORECASE)
-            # refined_prompt_clean = re.sub(r'\s*```\s*$', '', refined_prompt_clean, flags=re.IGNORECASE)
-            if not refined_prompt_clean:
-                 logging.warning(f"UID {uid}: Refine agent returned empty brief for modify, falling back to original prompt.")
-                 refined_prompt_clean = user_prompt_text
-
-            modify_agent_prompt_text = f"""**Modification Brief**\n{refined_prompt_clean}\n\n**Original User Prompt for context:**\n{user_prompt_text}\n\n**Figma Context:**\nFrame Name: {context.get('frameName', 'N/A')}\nElement Info: {context.get('elementInfo','N/A')}"""
-            message_parts = [google_genai_types.Part(text=modify_agent_prompt_text)]
-            try:
-                frame_bytes = base64.b64decode(frame_data_base64)
-                element_bytes = base64.b64decode(element_data_base64)
-                message_parts.append(google_genai_types.Part(inline_data=google_genai_types.Blob(mime_type="image/png", data=frame_bytes)))
-                message_parts.append(google_genai_types.Part(inline_data=google_genai_types.Blob(mime_type="image/png", data=element_bytes)))
-            except Exception as e:
-                raise ValueError(f"Invalid image data received for modify mode: {e}")
-            
-            modify_content = google_genai_types.Content(role='user', parts=message_parts)
-            modified_svg = await adk_utils.run_adk_interaction(
-                agents.modify_agent, modify_content, adk_utils.session_service,
-                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-            )
-            if not modified_svg or modified_svg.startswith("AGENT_ERROR:") or modified_svg.startswith("ADK_RUNTIME_ERROR:"):
-                raise ValueError(f"Modify Agent failed or returned error: {modified_svg}")
-            
-            cleaned_svg = adk_utils.is_valid_svg(modified_svg)
-            if not cleaned_svg:
-                 raise ValueError(f"Modify Agent response is not valid SVG. Snippet: {str(modified_svg)[:200]}...")
-            final_result = cleaned_svg
+            svg_flow_task = svg_flow_task or asyncio.create_task(run_modify_flow())
+            final_result = await svg_flow_task
             logging.info(f"UID {uid}: Modify flow successful.")
 
         elif intent_mode == 'answer':
             final_type = "answer"
             agent_used_name_log = agents.answer_agent.name
             logging.info(f"UID {uid}: --- Running Answer Agent (using key ...{api_key_for_this_entire_request[-4:]}) ---")
-            answer_prompt_text = f"{history_text}**User Query**\n{user_prompt_text}\n\nPlease provide a helpful design-related answer."
-            answer_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=answer_prompt_text)])
-            
-            answer_text = await adk_utils.run_adk_interaction(
-                agents.answer_agent, answer_content, adk_utils.session_service,
-                user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
-            )
+            # Only context-free questions are cacheable; with chat history the answer depends on the conversation
+            cacheable = not history_text
+            cached_answer = await asyncio.to_thread(answer_cache.lookup, user_prompt_text) if cacheable else None
+            if cached_answer:
+                logging.info(f"UID {uid}: Answer served from semantic cache.")
+                answer_text = cached_answer
+            else:
+                answer_prompt_text = f"{history_text}**User Query**\n{user_prompt_text}\n\nPlease provide a helpful design-related answer."
+                answer_content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=answer_prompt_text)])
+
+                answer_text = await adk_utils.run_adk_interaction(
+                    agents.answer_agent, answer_content, adk_utils.session_service,
+                    user_id=uid, api_key=api_key_for_this_entire_request # Use the held key
+                )
+                if cacheable and answer_text and not answer_text.startswith(("AGENT_ERROR:", "ADK_RUNTIME_ERROR:")):
+                    await asyncio.to_thread(answer_cache.store, user_prompt_text, answer_text)
             if not answer_text :
                  logging.info(f"UID {uid}: Answer agent returned empty response. Providing default.")
                  final_result = "I could not find specific information regarding your query at the moment."
@@ -318,10 +462,20 @@ async def handle_generate():
         logging.error(f"UID {uid}: {error_message} Details: {e}", exc_info=True)
         return jsonify({"success": False, "error": "An internal server error occurred."}), 500
     finally:
+        # --- Stop a speculative flow that is still running (early return/error) ---
+        # before its API key can be released back to the pool. Awaiting it also retrieves
+        # the error of a flow that failed but was never used.
+        if svg_flow_task:
+            svg_flow_task.cancel()
+            try:
+                await svg_flow_task
+            except (asyncio.CancelledError, Exception):
+                pass
+
         # --- Release the pooled project IF it was acquired for this request ---
         if project_in_use_for_this_request: # This implies run_interaction_method was 'pooled_key'
-            await api_handler.release_project(project_in_use_for_this_request)
-            logging.info(f"UID {uid}: Released pooled project '{project_in_use_for_this_request['id']}' after request completion/failure.")
+            api_handler.release_project(project_in_use_for_this_request)
+            logging.info(f"UID {uid}: Released pooled project '{project_in_use_for_this_request.id}' after request completion/failure.")
 
     # --- Format and Return Success Response ---
     if final_result is None and not (intent_mode_raw.startswith("AGENT_ERROR:") or intent_mode_raw.startswith("ADK_RUNTIME_ERROR:")) : # Check if error already handled
@@ -339,7 +493,7 @@ async def handle_generate():
         "using_own_key": run_interaction_method == 'user_key'
     }
     if final_type == "svg":
-        final_result = replace_svg_image_links_with_base64(final_result)
+        final_result = await asyncio.to_thread(postprocess_svg, final_result) # Copies the context, so the request's image cache is shared
         response_payload["svg"] = final_result
         try:
             with open("output.svg", 'w', encoding='utf-8', errors='replace') as f:
@@ -350,7 +504,7 @@ async def handle_generate():
     elif final_type == "answer":
         response_payload["answer"] = final_result
     
-    key_info = f"(User's key)" if run_interaction_method == 'user_key' else f"(Pooled project: {project_in_use_for_this_request['id'] if project_in_use_for_this_request else 'N/A'})"
+    key_info = f"(User's key)" if run_interaction_method == 'user_key' else f"(Pooled project: {project_in_use_for_this_request.id if project_in_use_for_this_request else 'N/A'})"
     logging.info(f"UID {uid}: Request completed successfully (type: {final_type}) {key_info}. Trial count: {requests_today}.")
     return jsonify(response_payload), 200
 
@@ -366,7 +520,7 @@ def firebase_config():
 
 # --- Run the App (Unchanged) ---
 if __name__ == '__main__':
-    logging.info(f"Running Flask app with AGENT_MODEL='{config.AGENT_MODEL}'")
+    logging.info(f"Running Quart app with AGENT_MODEL='{config.AGENT_MODEL}'")
     logging.info("Ensure Firebase Admin SDK is initialized (via import of firebase_admin_init).")
     logging.info("Ensure Firebase Client Config JSON and ENCRYPTION_KEY are set in .env and parsed.")
 
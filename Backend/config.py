@@ -65,7 +65,38 @@ except json.JSONDecodeError as e:
 # --- ADK Shared Configuration ---
 APP_NAME = "figma_ai_assistant"
 AGENT_MODEL = "gemini-2.5-flash-preview-05-20" #! 05-20 is latest
-DECISION_MODEL = "gemini-2.0-flash"
+# Per-agent models, each overridable from .env. The decision agent only emits one word, so it
+# runs on a fast flash model; the others default to AGENT_MODEL. A lighter router (e.g.
+# DECISION_MODEL=gemini-2.0-flash-lite) is opt-in: check it against AGENT_MODEL with
+# scripts/eval_decision_model.py before switching.
+DECISION_MODEL = os.getenv("DECISION_MODEL", "gemini-2.0-flash")
+REFINE_MODEL = os.getenv("REFINE_MODEL", AGENT_MODEL)
+CREATE_MODEL = os.getenv("CREATE_MODEL", AGENT_MODEL) # Output quality matters most here
+MODIFY_MODEL = os.getenv("MODIFY_MODEL", AGENT_MODEL) # Must have vision capability
+# Model cascade for the SVG agents: when the output of one tier is not valid SVG, the request
+# is retried on the next model. Comma-separated, e.g. CREATE_ESCALATION_MODELS=gemini-2.5-pro.
+# Empty by default (single tier), since stronger tiers cost more per call.
+CREATE_ESCALATION_MODELS = [m.strip() for m in os.getenv("CREATE_ESCALATION_MODELS", "").split(",") if m.strip()]
+MODIFY_ESCALATION_MODELS = [m.strip() for m in os.getenv("MODIFY_ESCALATION_MODELS", "").split(",") if m.strip()]
+# Frontend modes ('create', 'modify', 'answer') that are taken as the intent without running the
+# intent router or the decision agent. The plugin derives its mode from the Figma selection, so a
+# question asked with an element selected would be routed to modify; opt in per mode, e.g.
+# TRUSTED_CLIENT_MODES=create. Empty by default (every request is classified).
+TRUSTED_CLIENT_MODES = frozenset(m.strip() for m in os.getenv("TRUSTED_CLIENT_MODES", "").split(",") if m.strip())
+
+# Per-agent output caps (max_output_tokens), each overridable from .env. Only the decision
+# agent is capped by default: it answers with a single word, so a small cap stops runaway
+# output early. On 2.5 models thinking tokens count against the cap, so caps for the other
+# agents are opt-in (unset = model default) to avoid truncating SVGs mid-element.
+def _env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+DECISION_MAX_OUTPUT_TOKENS = _env_int("DECISION_MAX_OUTPUT_TOKENS", 8)
+REFINE_MAX_OUTPUT_TOKENS = _env_int("REFINE_MAX_OUTPUT_TOKENS")
+CREATE_MAX_OUTPUT_TOKENS = _env_int("CREATE_MAX_OUTPUT_TOKENS")
+MODIFY_MAX_OUTPUT_TOKENS = _env_int("MODIFY_MAX_OUTPUT_TOKENS")
+ANSWER_MAX_OUTPUT_TOKENS = _env_int("ANSWER_MAX_OUTPUT_TOKENS")
 
 
 # Export configuration variables
@@ -75,5 +106,17 @@ __all__ = [
     "FIREBASE_CLIENT_CONFIG",
     "ENCRYPTION_KEY", # Export the encryption key
     "APP_NAME",
-    "AGENT_MODEL"
+    "AGENT_MODEL",
+    "DECISION_MODEL",
+    "REFINE_MODEL",
+    "CREATE_MODEL",
+    "MODIFY_MODEL",
+    "CREATE_ESCALATION_MODELS",
+    "MODIFY_ESCALATION_MODELS",
+    "TRUSTED_CLIENT_MODES",
+    "DECISION_MAX_OUTPUT_TOKENS",
+    "REFINE_MAX_OUTPUT_TOKENS",
+    "CREATE_MAX_OUTPUT_TOKENS",
+    "MODIFY_MAX_OUTPUT_TOKENS",
+    "ANSWER_MAX_OUTPUT_TOKENS",
 ]
\ No newline at end of file
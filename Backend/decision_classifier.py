@@ -0,0 +1,171 @@
+# decision_classifier.py
+# Local intent routing in front of the decision agent: a keyword preflight, then a logistic
+# regression over sentence embeddings of labeled prompts. Only confident predictions that
+# agree with the frontend's selection mode are returned; everything else falls back to the
+# LLM decision agent, which also sees the Figma context and chat history.
+import asyncio
+import functools
+import json
+import re
+from pathlib import Path
+
+import embed
+
+# --- Configuration ---
+# Minimum predicted probability of the top intent to trust the classifier
+MIN_CONFIDENCE = 0.7
+# Inverse regularization strength; embeddings are unit-length, so the default of 1.0 keeps
+# probabilities too flat to ever clear MIN_CONFIDENCE
+CLASSIFIER_C = 10.0
+# Optional extra training data, one {"prompt": ..., "intent": ...} object per line, e.g.
+# produced offline by scripts/bootstrap_intent_examples.py
+LABELED_EXAMPLES_PATH = Path(__file__).resolve().parent / "intent_examples.jsonl"
+
+# --- Labeled Examples (intent -> prompts) ---
+INTENT_EXAMPLES = {
+    "create": [
+        "Create a login form for a mobile app",
+        "Generate a hero section for a SaaS landing page",
+        "Design a dashboard for a fitness tracker",
+        "Make a home screen for a food delivery app",
+        "Build a pricing page with three tiers",
+        "Design a settings page for a productivity web app",
+        "Create an onboarding screen for a meditation app",
+        "Generate a checkout page for an online store",
+        "Make a signup screen for a crypto wallet",
+        "Design a profile page for a social network",
+    ],
+    "modify": [
+        "Change the color of this button to blue",
+        "Make the title text larger and bold",
+        "Adjust the padding on this card",
+        "Update the icon to a shopping cart",
+        "Make this button rounded",
+        "Fix the alignment of the selected element",
+        "Change the background to a gradient",
+        "Make the text in this element white",
+        "Add a soft shadow to this card",
+        "Make the selected element smaller",
+    ],
+    "answer": [
+        "What are the latest UI design trends?",
+        "How do I use this tool?",
+        "Search for blue color palettes",
+        "Tell me a joke",
+        "Explain the golden ratio in design",
+        "What fonts go well with Inter?",
+        "Show me examples of minimalist websites",
+        "What is the difference between UI and UX?",
+        "Where can I find free icon libraries?",
+        "Hi, how are you?",
+    ],
+}
+
+# --- Keyword Preflight ---
+# Imperative trigger words from the decision agent's instruction. A prompt that matches
+# exactly one pattern set (and is not phrased as a question) is routed without any model.
+# Words that are also common nouns ("design", "build") are left out: "Tips for web design"
+# is a question in all but punctuation.
+_CREATE_RE = re.compile(r'\b(create|generate|make an?)\b', re.IGNORECASE)
+_MODIFY_RE = re.compile(r'\b(change|modify|adjust|update|fix|make (this|the|it))\b', re.IGNORECASE)
+_QUESTION_RE = re.compile(r'^\s*(what|why|how|who|where|when|which|can|could|should|is|are|do|does)\b|\?\s*$', re.IGNORECASE)
+
+
+def match_keyword_intent(prompt_text: str) -> str | None:
+    """
+    Returns 'create' or 'modify' when the prompt hits the trigger words of exactly one
+    intent, otherwise None (ambiguous prompts and questions go to the slower routers).
+    """
+    if not prompt_text or _QUESTION_RE.search(prompt_text):
+        return None
+    is_create = _CREATE_RE.search(prompt_text) is not None
+    is_modify = _MODIFY_RE.search(prompt_text) is not None
+    if is_create == is_modify:
+        return None
+    return 'create' if is_create else 'modify'
+
+
+def _load_labeled_examples():
+    """Returns (texts, labels) from INTENT_EXAMPLES plus LABELED_EXAMPLES_PATH if it exists."""
+    texts = [prompt for prompts in INTENT_EXAMPLES.values() for prompt in prompts]
+    labels = [intent for intent, prompts in INTENT_EXAMPLES.items() for _ in prompts]
+    if LABELED_EXAMPLES_PATH.exists():
+        with LABELED_EXAMPLES_PATH.open(encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                example = json.loads(line)
+                if example.get("intent") in INTENT_EXAMPLES and example.get("prompt"):
+                    texts.append(example["prompt"])
+                    labels.append(example["intent"])
+    return texts, labels
+
+
+@functools.lru_cache(maxsize=1)
+def _load_classifier():
+    """
+    Fits the intent classifier on the embedded labeled examples once.
+    Returns the fitted LogisticRegression, or None if no embedding model is available
+    (local routing is then disabled). scikit-learn is a dependency of sentence-transformers.
+    """
+    texts, labels = _load_labeled_examples()
+    example_matrix = embed.encode(texts)
+    if example_matrix is None:
+        return None
+
+    from sklearn.linear_model import LogisticRegression
+    classifier = LogisticRegression(C=CLASSIFIER_C, max_iter=1000)
+    classifier.fit(example_matrix, labels)
+    print(f"decision_classifier: Trained on {len(texts)} labeled examples.")
+    return classifier
+
+
+def classify_intent(prompt_text: str) -> str | None:
+    """
+    Classifies a prompt as 'create', 'modify' or 'answer' with the embedding classifier.
+    Returns None when the classifier is unavailable or not confident enough, in which case
+    the caller should fall back to the decision agent.
+    """
+    if not prompt_text:
+        return None
+    classifier = _load_classifier()
+    if classifier is None:
+        return None
+
+    probabilities = classifier.predict_proba(embed.encode([prompt_text]))[0]
+    best = int(probabilities.argmax())
+    if probabilities[best] < MIN_CONFIDENCE:
+        return None
+    return str(classifier.classes_[best])
+
+
+class LocalIntentRouter:
+    """Resolves the intent of a prompt without an LLM call, when it can."""
+
+    async def route(self, prompt_text: str, frontend_mode: str | None) -> tuple[str | None, str | None]:
+        """
+        Returns (intent, resolved_by), or (None, None) when the caller should fall back to
+        the decision agent. A local result is only trusted when it matches frontend_mode (the
+        mode implied by the Figma selection); a disagreement is left to the decision agent.
+        Embedding runs on CPU, so it is kept off the event loop.
+        """
+        if frontend_mode not in INTENT_EXAMPLES:
+            return None, None
+        intent = match_keyword_intent(prompt_text)
+        if intent:
+            return (intent, "keyword preflight") if intent == frontend_mode else (None, None)
+        intent = await asyncio.to_thread(classify_intent, prompt_text)
+        if intent == frontend_mode:
+            return intent, "local classifier"
+        return None, None
+
+
+# Single process-wide router
+intent_router = LocalIntentRouter()
+
+__all__ = [
+    "match_keyword_intent",
+    "classify_intent",
+    "LocalIntentRouter",
+    "intent_router",
+]
@@ -0,0 +1,43 @@
+# embed.py
+# Process-wide sentence embedding model shared by the local intent classifier
+# (decision_classifier.py) and the semantic caches (semantic_cache.py), so the
+# model is loaded and held in memory once.
+import functools
+
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 128 # Prompts are short; capping the sequence keeps encoding cheap
+
+
+@functools.lru_cache(maxsize=1)
+def get_embedder():
+    """
+    Returns the shared SentenceTransformer, loading it on first call.
+    Returns None if sentence-transformers is not installed (embedding features are then disabled).
+    """
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("embed: sentence-transformers not installed. Local intent routing and answer caching disabled.")
+        return None
+
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    model.max_seq_length = MAX_SEQ_LENGTH
+    if model.device.type == "cuda":
+        model = model.half() # fp16 halves memory traffic on GPU; CPU stays fp32
+    print(f"embed: Loaded '{EMBEDDING_MODEL_NAME}' on {model.device}.")
+    return model
+
+
+def encode(texts: list[str]):
+    """Encodes texts into L2-normalized embeddings (rows), or returns None if no model is available."""
+    model = get_embedder()
+    if model is None:
+        return None
+    return model.encode(texts, normalize_embeddings=True)
+
+
+__all__ = [
+    "get_embedder",
+    "encode",
+]
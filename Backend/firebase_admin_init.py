@@ -2,7 +2,6 @@
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 import datetime
-import pytz
 import os
 
 # --- Local Imports ---
@@ -63,7 +62,7 @@ def _update_trial_usage_in_transaction(transaction, uid):
     requests_today = data.get('requests_today', 0)
     encrypted_api_key = data.get('encrypted_api_key')
 
-    utc_now = datetime.datetime.now(pytz.utc)
+    utc_now = datetime.datetime.now(datetime.timezone.utc)
     today_utc = utc_now.date()
 
     TRIAL_LIMIT = int(os.getenv("MAX_TRIAL"))
@@ -71,9 +70,9 @@ def _update_trial_usage_in_transaction(transaction, uid):
     last_reset_date = None
     if last_reset_timestamp:
          try:
-            last_reset_date = last_reset_timestamp.astimezone(pytz.utc).date()
+            last_reset_date = last_reset_timestamp.astimezone(datetime.timezone.utc).date()
          except ValueError:
-            last_reset_date = last_reset_timestamp.replace(tzinfo=pytz.utc).astimezone(pytz.utc).date()
+            last_reset_date = last_reset_timestamp.replace(tzinfo=datetime.timezone.utc).astimezone(datetime.timezone.utc).date()
          except Exception as e:
             print(f"Warning: Could not convert timestamp {last_reset_timestamp} to date for UID {uid}: {e}")
             last_reset_date = None
@@ -168,13 +167,13 @@ def _create_user_doc_in_transaction(transaction, uid, email=None):
 
     if not user_doc.exists:
         print(f"User document not found for {uid}. Creating...")
-        utc_now = datetime.datetime.now(pytz.utc)
+        utc_now = datetime.datetime.now(datetime.timezone.utc)
         initial_data = {
             'requests_today': 0, # Start with 0 trials used for the day
             'last_reset_date': utc_now,
             'created_at': utc_now,
             'email': email, # Store email if available from token
-            'encrypted_api_key': None # Add a field for the encrypted API key
+            'encrypted_api_key': None # Add a field for the encrypted API key (stored as bytes)
         }
         # Use set within the transaction to create the document
         transaction.set(user_doc_ref, initial_data)
@@ -221,7 +220,7 @@ def _store_api_key_in_transaction(transaction, uid, encrypted_key):
          'encrypted_api_key': encrypted_key,
          # Optionally reset trials when user provides key? Depends on business logic.
          # 'requests_today': 0,
-         # 'last_reset_date': datetime.datetime.now(pytz.utc),
+         # 'last_reset_date': datetime.datetime.now(datetime.timezone.utc),
      }
      transaction.set(user_doc_ref, update_data, merge=True)
      print(f"Stored encrypted API key for UID: {uid}")
@@ -286,9 +285,9 @@ def has_api_key_stored(uid: str) -> bool:
         user_doc = user_doc_ref.get(["encrypted_api_key"]) # Only fetch this specific field
         if user_doc.exists:
             data = user_doc.to_dict()
-            # Check if the field exists and is not None/empty string
+            # Check if the field exists and is not None/empty (bytes, or a legacy Fernet str)
             encrypted_key = data.get('encrypted_api_key')
-            return encrypted_key is not None and encrypted_key != ''
+            return bool(encrypted_key)
         else:
             # If the document doesn't exist, they certainly don't have a key stored
             return False
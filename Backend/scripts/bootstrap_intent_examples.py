@@ -0,0 +1,62 @@
+# bootstrap_intent_examples.py
+# Offline helper: labels a corpus of user prompts with the LLM decision agent and writes them
+# as training data for the local intent classifier (decision_classifier.LABELED_EXAMPLES_PATH).
+# Runs against the server's GOOGLE_API_KEY, so it needs the same .env as the app.
+#
+# Usage (from Backend/):
+#   python scripts/bootstrap_intent_examples.py prompts.txt            # one prompt per line
+#   python scripts/bootstrap_intent_examples.py prompts.txt --append   # keep existing labels
+import argparse
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # Backend modules are flat imports
+
+from google.genai import types as google_genai_types
+
+import adk_utils
+import agents
+from decision_classifier import INTENT_EXAMPLES, LABELED_EXAMPLES_PATH
+
+MAX_CONCURRENCY = 4 # Parallel decision-agent calls (stay under the key's rate limit)
+
+
+async def label_prompts(prompts):
+    """Returns [(prompt, intent)] for the prompts the decision agent labeled with a known intent."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def label(prompt):
+        content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=f"**User Request**\n{prompt}")])
+        async with semaphore:
+            response = await adk_utils.run_adk_interaction(
+                agents.decision_agent, content, adk_utils.session_service, user_id="intent_bootstrap"
+            )
+        intent = (response or "").strip().lower()
+        return prompt, intent if intent in INTENT_EXAMPLES else None
+
+    labeled = await asyncio.gather(*(label(prompt) for prompt in prompts))
+    return [(prompt, intent) for prompt, intent in labeled if intent]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Label prompts with the decision agent for the local intent classifier.")
+    parser.add_argument("corpus", type=Path, help="Text file with one user prompt per line")
+    parser.add_argument("--output", type=Path, default=LABELED_EXAMPLES_PATH, help="JSONL file to write")
+    parser.add_argument("--append", action="store_true", help="Append to the output instead of overwriting it")
+    args = parser.parse_args()
+
+    prompts = [line.strip() for line in args.corpus.read_text(encoding="utf-8").splitlines() if line.strip()]
+    labeled = asyncio.run(label_prompts(prompts))
+
+    with args.output.open("a" if args.append else "w", encoding="utf-8") as f:
+        for prompt, intent in labeled:
+            f.write(json.dumps({"prompt": prompt, "intent": intent}) + "\n")
+
+    counts = {intent: sum(1 for _, label in labeled if label == intent) for intent in INTENT_EXAMPLES}
+    print(f"Labeled {len(labeled)}/{len(prompts)} prompts {counts} -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# compress_prompts.py
+# Build-time helper: strips Markdown ornamentation from agent instructions in prompts/ to cut
+# the input tokens prefilled on every request. Only formatting is removed (bold markers,
+# horizontal rules, list padding, blank-line runs); wording is left alone. Fenced code blocks
+# are copied verbatim.
+#
+# Usage (from Backend/):
+#   python scripts/compress_prompts.py                 # report before/after sizes
+#   python scripts/compress_prompts.py --write         # rewrite the prompt files in place
+#
+# refine.md and answer.md are not compressed by default: their agents answer in Markdown
+# and the formatting of those instructions doubles as the output example.
+import argparse
+import re
+from pathlib import Path
+
+PROMPTS_DIR = Path(__file__).resolve().parent.parent / "prompts"
+DEFAULT_PROMPTS = ["create", "decision", "modify"]
+
+_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
+_RULE_RE = re.compile(r'^\s*-{3,}\s*$')
+_BULLET_RE = re.compile(r'^\s*[*-]\s+')
+_NUMBERED_RE = re.compile(r'^\s*(\d+\.)\s+')
+
+
+def compress(text: str) -> str:
+    """Returns the prompt with Markdown ornamentation and redundant whitespace removed."""
+    out = []
+    in_fence = False
+    open_indents = [] # Indent widths of the enclosing list levels of the current line
+    for line in text.expandtabs(4).splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+            out.append(line.strip())
+            continue
+        if in_fence:
+            out.append(line.rstrip())
+            continue
+        if _RULE_RE.match(line):
+            continue
+        # Keep list nesting, but as one space per level instead of the original padding. Levels
+        # come from the relative indentation of enclosing lines, so the output (1-space steps)
+        # maps to the same levels and a second run is a no-op.
+        if line.strip():
+            width = len(line) - len(line.lstrip())
+            while open_indents and open_indents[-1] > width:
+                open_indents.pop()
+            if not open_indents or open_indents[-1] < width:
+                open_indents.append(width)
+            indent = " " * (len(open_indents) - 1)
+        else:
+            indent = ""
+        line = _BOLD_RE.sub(r'\1', line)
+        line = _BULLET_RE.sub('- ', line)
+        line = _NUMBERED_RE.sub(r'\1 ', line)
+        line = re.sub(r'[ \t]{2,}', ' ', line.strip())
+        if line:
+            line = indent + line
+        if not line and (not out or not out[-1]):
+            continue # Collapse runs of blank lines
+        out.append(line)
+    return "\n".join(out).strip() + "\n"
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when installed, otherwise estimates ~4 characters per token."""
+    try:
+        import tiktoken
+    except ImportError:
+        return len(text) // 4
+    return len(tiktoken.get_encoding("cl100k_base").encode(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Strip Markdown ornamentation from agent prompts.")
+    parser.add_argument("names", nargs="*", default=DEFAULT_PROMPTS, help="Prompt names (prompts/<name>.md)")
+    parser.add_argument("--write", action="store_true", help="Rewrite the prompt files in place")
+    args = parser.parse_args()
+
+    for name in args.names:
+        path = PROMPTS_DIR / f"{name}.md"
+        original = path.read_text(encoding="utf-8")
+        compressed = compress(original)
+        before, after = count_tokens(original), count_tokens(compressed)
+        print(f"{name}: {before} -> {after} tokens ({100 * (before - after) / max(before, 1):.1f}% smaller)")
+        if args.write:
+            path.write_text(compressed, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
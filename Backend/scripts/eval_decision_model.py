@@ -0,0 +1,106 @@
+# eval_decision_model.py
+# Offline gate for swapping DECISION_MODEL: labels a sample of user prompts with a reference
+# model (AGENT_MODEL by default) and with the candidate decision model, using the same
+# decision instruction and output config, and reports how often the two agree.
+# Exits non-zero when agreement is below --min-agreement, so a smaller/faster model is only
+# promoted once it matches the heavy model on real traffic.
+# Runs against the server's GOOGLE_API_KEY, so it needs the same .env as the app.
+#
+# Usage (from Backend/):
+#   python scripts/eval_decision_model.py prompts.txt                          # DECISION_MODEL vs AGENT_MODEL
+#   python scripts/eval_decision_model.py prompts.txt --candidate gemini-2.0-flash-lite --sample 200
+import argparse
+import asyncio
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # Backend modules are flat imports
+
+from google.adk.agents import Agent
+from google.genai import types as google_genai_types
+
+import adk_utils
+import agents
+from config import AGENT_MODEL, DECISION_MODEL, DECISION_MAX_OUTPUT_TOKENS
+from decision_classifier import INTENT_EXAMPLES
+
+MAX_CONCURRENCY = 4 # Parallel decision-agent calls per model (stay under the key's rate limit)
+DEFAULT_SAMPLE_SIZE = 200
+DEFAULT_MIN_AGREEMENT = 0.95
+
+
+def build_decision_agent(model: str) -> Agent:
+    """Decision agent identical to agents.decision_agent except for the model."""
+    return Agent(
+        name="intent_router_eval_" + "".join(c if c.isalnum() else "_" for c in model),
+        model=adk_utils.ContextKeyGemini(model=model),
+        description="Classifies the user's request into 'create', 'modify', or 'answer'.",
+        instruction=agents._load_prompt("decision"),
+        generate_content_config=agents._output_config(DECISION_MAX_OUTPUT_TOKENS, stop_sequences=["\n"]),
+        tools=[],
+    )
+
+
+async def label_prompts(agent: Agent, prompts):
+    """Returns the agent's intent for each prompt (None when the reply is not a known intent)."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def label(prompt):
+        content = google_genai_types.Content(role='user', parts=[google_genai_types.Part(text=f"**User Request**\n{prompt}")])
+        async with semaphore:
+            response = await adk_utils.run_adk_interaction(
+                agent, content, adk_utils.session_service, user_id="decision_eval"
+            )
+        intent = (response or "").strip().lower()
+        return intent if intent in INTENT_EXAMPLES else None
+
+    return await asyncio.gather(*(label(prompt) for prompt in prompts))
+
+
+async def evaluate(prompts, reference_model: str, candidate_model: str):
+    """Labels the prompts with both models concurrently and returns (reference_labels, candidate_labels)."""
+    return await asyncio.gather(
+        label_prompts(build_decision_agent(reference_model), prompts),
+        label_prompts(build_decision_agent(candidate_model), prompts),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that a candidate decision model agrees with the reference model.")
+    parser.add_argument("corpus", type=Path, help="Text file with one user prompt per line")
+    parser.add_argument("--reference", default=AGENT_MODEL, help="Model whose labels are treated as ground truth")
+    parser.add_argument("--candidate", default=DECISION_MODEL, help="Model being considered for DECISION_MODEL")
+    parser.add_argument("--sample", type=int, default=DEFAULT_SAMPLE_SIZE, help="Number of prompts to sample from the corpus")
+    parser.add_argument("--min-agreement", type=float, default=DEFAULT_MIN_AGREEMENT, help="Agreement required to pass")
+    parser.add_argument("--seed", type=int, default=0, help="Sampling seed, for reproducible runs")
+    args = parser.parse_args()
+
+    prompts = [line.strip() for line in args.corpus.read_text(encoding="utf-8").splitlines() if line.strip()]
+    if len(prompts) > args.sample:
+        prompts = random.Random(args.seed).sample(prompts, args.sample)
+
+    reference_labels, candidate_labels = asyncio.run(evaluate(prompts, args.reference, args.candidate))
+
+    # Prompts the reference model could not label carry no ground truth
+    scored = [(ref, cand) for ref, cand in zip(reference_labels, candidate_labels) if ref]
+    if not scored:
+        print(f"No prompts were labeled by the reference model '{args.reference}'.")
+        sys.exit(1)
+    agreement = sum(1 for ref, cand in scored if ref == cand) / len(scored)
+    confusions = Counter(f"{ref}->{cand}" for ref, cand in scored if ref != cand)
+
+    print(f"Reference: {args.reference}  Candidate: {args.candidate}")
+    print(f"Agreement: {agreement:.1%} on {len(scored)}/{len(prompts)} labeled prompts (required {args.min_agreement:.0%})")
+    if confusions:
+        print(f"Disagreements: {dict(confusions.most_common())}")
+
+    if agreement < args.min_agreement:
+        print("FAIL: keep the current DECISION_MODEL.")
+        sys.exit(1)
+    print("PASS: candidate can be used as DECISION_MODEL.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# semantic_cache.py
+# Semantic caches in front of expensive agent calls. Prompts repeat a lot across users
+# ("What is the golden ratio?", "login screen for a crypto wallet"), so a near-duplicate
+# prompt returns the stored response instead of re-running the agent (and its tools).
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import embed
+
+# --- Configuration ---
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+EXACT_MAX_ENTRIES = 1024
+EXACT_TTL_SECONDS = 3600
+FRESH_TTL_SECONDS = 24 * 3600 # Time-sensitive questions (trends, "latest", ...) expire sooner
+_FRESHNESS_RE = re.compile(r'\b(trend|trends|trending|latest|newest|current|today|this year|20\d\d)\b', re.IGNORECASE)
+
+
+class ExactResponseCache:
+    """
+    In-process cache of (namespace, prompt) -> response for verbatim repeats, with a TTL per
+    entry and least-recently-used eviction past max_entries. Needs no embedding model.
+    """
+
+    def __init__(self, namespace: str = "", max_entries: int = EXACT_MAX_ENTRIES, ttl_seconds: float = EXACT_TTL_SECONDS):
+        self.namespace = namespace # e.g. the agent name, so caches of different agents never collide
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # sha256 digest -> (response, expires_at)
+        self._lock = threading.Lock() # lookup/store run in worker threads (asyncio.to_thread)
+
+    def _key(self, prompt: str) -> bytes:
+        return hashlib.sha256(f"{self.namespace}\0{prompt}".encode()).digest()
+
+    def lookup(self, prompt: str) -> str | None:
+        """Returns the cached response for this exact prompt, or None."""
+        if not prompt:
+            return None
+        key = self._key(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def store(self, prompt: str, response: str, ttl_seconds: float | None = None):
+        """Caches a response for ttl_seconds (default: the cache's TTL)."""
+        if not prompt or not response:
+            return
+        key = self._key(prompt)
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._entries[key] = (response, expires_at)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SemanticCache:
+    """
+    Two-tier response cache. Verbatim repeats are answered by an ExactResponseCache, which
+    works with or without an embedding model. Near-duplicates are found by an in-process
+    nearest-neighbour search over prompt embeddings, used only when embed.encode works.
+    Embeddings live in a preallocated matrix used as a ring buffer, so a lookup is one
+    matrix-vector product and a store overwrites the oldest slot once the cache is full.
+    """
+
+    def __init__(self, similarity_threshold: float, max_entries: int, ttl_seconds: int = DEFAULT_TTL_SECONDS, fresh_ttl_seconds: int | None = None, namespace: str = ""):
+        self.similarity_threshold = similarity_threshold # Cosine similarity needed to treat two prompts as the same
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fresh_ttl_seconds = fresh_ttl_seconds # TTL for prompts matching _FRESHNESS_RE, if set
+        self._embeddings = None # (max_entries, dim) matrix of normalized embeddings, allocated on first store
+        self._expires_at = None # Per-slot expiry timestamps; 0 marks an empty slot
+        self._responses = [None] * max_entries
+        self._next_slot = 0
+        self._exact = ExactResponseCache(namespace, max_entries=min(max_entries, EXACT_MAX_ENTRIES), ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock() # lookup/store run in worker threads (asyncio.to_thread)
+
+    def _encode(self, prompt: str):
+        embeddings = embed.encode([prompt])
+        return None if embeddings is None else embeddings[0]
+
+    def lookup(self, prompt: str) -> str | None:
+        """Returns the cached response for the same or a sufficiently similar prompt, or None."""
+        if not prompt:
+            return None
+        response = self._exact.lookup(prompt)
+        if response is not None or self._embeddings is None:
+            return response
+        query = self._encode(prompt)
+        if query is None:
+            return None
+
+        import numpy as np
+        with self._lock:
+            similarities = self._embeddings @ query
+            similarities[self._expires_at <= time.time()] = -np.inf # Skip expired and empty slots
+            best = int(similarities.argmax())
+            if similarities[best] >= self.similarity_threshold:
+                return self._responses[best]
+        return None
+
+    def store(self, prompt: str, response: str):
+        """Caches a response, overwriting the oldest entry once max_entries is reached."""
+        if not prompt or not response:
+            return
+        ttl = self.ttl_seconds
+        if self.fresh_ttl_seconds is not None and _FRESHNESS_RE.search(prompt):
+            ttl = self.fresh_ttl_seconds
+
+        self._exact.store(prompt, response, ttl)
+        embedding = self._encode(prompt)
+        if embedding is None:
+            return # No embedding model: exact matches only
+
+        import numpy as np
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_entries, embedding.shape[0]), dtype=embedding.dtype)
+                self._expires_at = np.zeros(self.max_entries)
+            slot = self._next_slot
+            self._embeddings[slot] = embedding
+            self._expires_at[slot] = time.time() + ttl
+            self._responses[slot] = response
+            self._next_slot = (slot + 1) % self.max_entries
+
+
+# --- Process-wide caches ---
+# Answers to context-free design questions
+answer_cache = SemanticCache(similarity_threshold=0.93, max_entries=1024, fresh_ttl_seconds=FRESH_TTL_SECONDS)
+# Refine agent design briefs, keyed by the user prompt. Briefs carry app names and Pixabay
+# links (which expire after 24h), so matching is stricter and entries live for a day.
+brief_cache = SemanticCache(similarity_threshold=0.95, max_entries=10000, ttl_seconds=24 * 3600)
+
+__all__ = [
+    "ExactResponseCache",
+    "SemanticCache",
+    "answer_cache",
+    "brief_cache",
+]
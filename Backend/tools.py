@@ -1,10 +1,87 @@
 import requests
+import asyncio
 import base64
 import mimetypes
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse
 import os
+import io
+import json
+import time
+import sqlite3
+import threading
+import hashlib
+from collections import OrderedDict
+from contextlib import closing
+from contextvars import ContextVar
 from typing import List, Dict, Union
+from PIL import Image
+
+# --- Request-Scoped Lookup Cache ---
+# Pixabay searches and image downloads repeat within one /generate request (the refine
+# agent re-issuing a query, the same image URL used several times in an SVG). Results are
+# memoized in a dict bound to the current request; outside a request nothing is cached.
+_request_cache: ContextVar[dict | None] = ContextVar("tools_request_cache", default=None)
+
+def start_request_cache():
+    """Binds a fresh lookup cache to the current request context. Call once per request."""
+    _request_cache.set({})
+
+PIXABAY_API_URL = "https://pixabay.com/api/"
+PIXABAY_MAX_CONCURRENCY = 8 # Concurrent Pixabay requests per tool call (rate-limit friendly)
+# Search results are cached on disk across requests and restarts. Pixabay's webformatURL
+# links are only valid for 24 hours, so entries expire a little before that.
+PIXABAY_CACHE_PATH = os.getenv("PIXABAY_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pixabay_cache.sqlite3"))
+PIXABAY_CACHE_TTL_SECONDS = 23 * 3600
+
+class PixabayResultCache:
+    """Disk-backed (sqlite) cache of image links per (query, num_images), with a TTL."""
+
+    def __init__(self, path, ttl_seconds):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            with self._init_lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS pixabay_results ("
+                    "query TEXT NOT NULL, num_images INTEGER NOT NULL, urls TEXT NOT NULL, expires_at REAL NOT NULL, "
+                    "PRIMARY KEY (query, num_images))"
+                )
+                self._initialized = True
+        return conn
+
+    def get(self, query, num_images):
+        """Returns the cached links, or None on a miss, an expired entry or a cache error."""
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT urls FROM pixabay_results WHERE query = ? AND num_images = ? AND expires_at > ?",
+                    (query, num_images, time.time()),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Pixabay cache read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, query, num_images, urls):
+        """Stores links for a query and drops expired entries."""
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO pixabay_results (query, num_images, urls, expires_at) VALUES (?, ?, ?, ?)",
+                    (query, num_images, json.dumps(urls), now + self.ttl_seconds),
+                )
+                conn.execute("DELETE FROM pixabay_results WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            print(f"Warning: Pixabay cache write failed: {e}")
+
+pixabay_result_cache = PixabayResultCache(PIXABAY_CACHE_PATH, PIXABAY_CACHE_TTL_SECONDS)
 
 class PixabayImageSearchTool:
     """
@@ -26,13 +103,14 @@ class PixabayImageSearchTool:
         if not api_key:
             raise ValueError("Pixabay API key cannot be empty. Please provide a valid key.")
         self.api_key = api_key
+        self._session = requests.Session() # Keep-alive connection to Pixabay across queries
         # Wrap the internal search function using ADK's LongRunningFunctionTool
         self.tool = self._search_images_internal
         # Propagate docstring and type hints from the internal function to the tool object
         self.__doc__ = self.tool.__doc__
         self.__annotations__ = self.tool.__annotations__
 
-    def _search_images_internal(
+    async def _search_images_internal(
         self,
         queries_info: List[Dict[str, Union[str, int]]],
     ) -> Dict[str, List[str]]:
@@ -56,8 +134,9 @@ class PixabayImageSearchTool:
             in the output dictionary. If fewer images are found than requested,
             all available images will be returned for that query.
         """
-        base_url = "https://pixabay.com/api/"
         results: Dict[str, List[str]] = {}
+        pending = {} # query -> effective_num_images_to_fetch, for queries not served from cache
+        request_cache = _request_cache.get()
 
         for item in queries_info:
             query = item.get("query")
@@ -71,67 +150,30 @@ class PixabayImageSearchTool:
                 print(f"Warning: Skipping search item for query '{query}' as 'num_images' is not positive.")
                 continue
 
-            images_for_current_query: List[str] = []
-            
             # Pixabay API limits `per_page` to 200 and `totalHits` (accessible images) to 500 per query.
             # We will fetch up to 500 images or the requested `num_images`, whichever is smaller.
             effective_num_images_to_fetch = min(num_images, 500)
-            
-            # Calculate the number of API pages (requests) needed, max 200 images per page
-            # Using ceiling division to ensure we cover all images if not a multiple of 200.
-            pages_to_fetch = (effective_num_images_to_fetch + 199) // 200 
-
-            for page_num in range(1, pages_to_fetch + 1):
-                # Stop if we've already collected enough images
-                if len(images_for_current_query) >= effective_num_images_to_fetch:
-                    break
-
-                # Calculate how many images to request on the current page
-                remaining_to_fetch = effective_num_images_to_fetch - len(images_for_current_query)
-                current_per_page = min(200, remaining_to_fetch) # Max 200 per page
-
-                if current_per_page <= 0: # Should not happen if logic is correct, but as a safeguard
-                    break
-
-                params = {
-                    "key": self.api_key,
-                    "q": query,
-                    "image_type": "photo", # Filtering for photos as per common use case
-                    "per_page": current_per_page,
-                    "page": page_num,
-                    "safesearch": "true" # Ensure family-friendly results by default
-                }
-
-                try:
-                    response = requests.get(base_url, params=params)
-                    response.raise_for_status()  # Raises HTTPError for 4xx/5xx responses
-                    data = response.json()
-
-                    if "hits" in data:
-                        for hit in data["hits"]:
-                            # The documentation suggests `webformatURL` for temporary display of search results.
-                            if "webformatURL" in hit:
-                                images_for_current_query.append(hit["webformatURL"])
-                                # Stop once we have gathered the required number of images
-                                if len(images_for_current_query) >= effective_num_images_to_fetch:
-                                    break
-                    else:
-                        print(f"No 'hits' found in response for query '{query}' (Page {page_num}). Response: {data}")
-
-                except requests.exceptions.HTTPError as e:
-                    print(f"HTTP Error for query '{query}' (Page {page_num}): Status {e.response.status_code} - {e.response.text}")
-                    # Common errors: 400 (Bad Request), 429 (Too Many Requests), 500 (Internal Server Error)
-                    # For rate limits (429), the tool might need a retry mechanism with backoff.
-                    break # Stop processing this query on HTTP error
-                except requests.exceptions.RequestException as e:
-                    print(f"Network or request error for query '{query}' (Page {page_num}): {e}")
-                    break # Stop processing this query on network error
-                except ValueError: # JSONDecodeError is a subclass of ValueError
-                    print(f"Failed to decode JSON response for query '{query}' (Page {page_num}).")
-                    break # Stop processing this query on invalid JSON
-                except Exception as e:
-                    print(f"An unexpected error occurred for query '{query}' (Page {page_num}): {e}")
-                    break
+
+            cache_key = ("pixabay", query, effective_num_images_to_fetch)
+            if request_cache is not None and cache_key in request_cache:
+                results[query] = request_cache[cache_key]
+                continue
+            pending[query] = effective_num_images_to_fetch
+
+        # Queries are independent: fetch them concurrently (bounded), so the tool takes
+        # about one round trip instead of one per query. The semaphore is per call because
+        # each request may run on its own event loop.
+        concurrency = asyncio.Semaphore(PIXABAY_MAX_CONCURRENCY)
+
+        async def fetch(query, effective_num_images_to_fetch):
+            async with concurrency:
+                return await asyncio.to_thread(self._fetch_query_images, query, effective_num_images_to_fetch)
+
+        fetched = await asyncio.gather(*(fetch(query, n) for query, n in pending.items()))
+
+        for (query, effective_num_images_to_fetch), images_for_current_query in zip(pending.items(), fetched):
+            if request_cache is not None and images_for_current_query: # Failed lookups may be retried
+                request_cache[("pixabay", query, effective_num_images_to_fetch)] = images_for_current_query
 
             # Only add the query to results if images were found
             if images_for_current_query:
@@ -139,13 +181,94 @@ class PixabayImageSearchTool:
 
         return results
 
+    def _fetch_query_images(self, query: str, effective_num_images_to_fetch: int) -> List[str]:
+        """Returns image links for one query from the disk cache, or from the API on a miss (blocking)."""
+        cached = pixabay_result_cache.get(query, effective_num_images_to_fetch)
+        if cached is not None:
+            return cached
+        images_for_current_query = self._fetch_query_images_from_api(query, effective_num_images_to_fetch)
+        if images_for_current_query: # Failed lookups may be retried
+            pixabay_result_cache.set(query, effective_num_images_to_fetch, images_for_current_query)
+        return images_for_current_query
+
+    def _fetch_query_images_from_api(self, query: str, effective_num_images_to_fetch: int) -> List[str]:
+        """Fetches up to effective_num_images_to_fetch image links for one query (blocking, page by page)."""
+        images_for_current_query: List[str] = []
+        
+        # Calculate the number of API pages (requests) needed, max 200 images per page
+        # Using ceiling division to ensure we cover all images if not a multiple of 200.
+        pages_to_fetch = (effective_num_images_to_fetch + 199) // 200 
+
+        for page_num in range(1, pages_to_fetch + 1):
+            # Stop if we've already collected enough images
+            if len(images_for_current_query) >= effective_num_images_to_fetch:
+                break
+
+            # Calculate how many images to request on the current page
+            remaining_to_fetch = effective_num_images_to_fetch - len(images_for_current_query)
+            current_per_page = min(200, remaining_to_fetch) # Max 200 per page
+
+            if current_per_page <= 0: # Should not happen if logic is correct, but as a safeguard
+                break
+
+            params = {
+                "key": self.api_key,
+                "q": query,
+                "image_type": "photo", # Filtering for photos as per common use case
+                "per_page": current_per_page,
+                "page": page_num,
+                "safesearch": "true" # Ensure family-friendly results by default
+            }
+
+            try:
+                response = self._session.get(PIXABAY_API_URL, params=params, timeout=10)
+                response.raise_for_status()  # Raises HTTPError for 4xx/5xx responses
+                data = response.json()
+
+                if "hits" in data:
+                    for hit in data["hits"]:
+                        # The documentation suggests `webformatURL` for temporary display of search results.
+                        if "webformatURL" in hit:
+                            images_for_current_query.append(hit["webformatURL"])
+                            # Stop once we have gathered the required number of images
+                            if len(images_for_current_query) >= effective_num_images_to_fetch:
+                                break
+                else:
+                    print(f"No 'hits' found in response for query '{query}' (Page {page_num}). Response: {data}")
+
+            except requests.exceptions.HTTPError as e:
+                print(f"HTTP Error for query '{query}' (Page {page_num}): Status {e.response.status_code} - {e.response.text}")
+                # Common errors: 400 (Bad Request), 429 (Too Many Requests), 500 (Internal Server Error)
+                # For rate limits (429), the tool might need a retry mechanism with backoff.
+                break # Stop processing this query on HTTP error
+            except requests.exceptions.RequestException as e:
+                print(f"Network or request error for query '{query}' (Page {page_num}): {e}")
+                break # Stop processing this query on network error
+            except ValueError: # JSONDecodeError is a subclass of ValueError
+                print(f"Failed to decode JSON response for query '{query}' (Page {page_num}).")
+                break # Stop processing this query on invalid JSON
+            except Exception as e:
+                print(f"An unexpected error occurred for query '{query}' (Page {page_num}): {e}")
+                break
+
+        return images_for_current_query
+
 
 def fetch_image_as_base64(src):
     """Fetch an image from a URL or local path and return it as a base64 data URI."""
-    try:
-        if src.startswith("data:"):
-            return src  # already base64
+    if src.startswith("data:"):
+        return src  # already base64
+    request_cache = _request_cache.get()
+    cache_key = ("image", src)
+    if request_cache is not None and cache_key in request_cache:
+        return request_cache[cache_key]
+    data_uri = _fetch_image_as_base64(src)
+    if request_cache is not None:
+        request_cache[cache_key] = data_uri
+    return data_uri
 
+def _fetch_image_as_base64(src):
+    try:
         if src.startswith("http"):
             response = requests.get(src, timeout=5)
             response.raise_for_status()
@@ -162,6 +285,42 @@ def fetch_image_as_base64(src):
         print(f"[!] Could not convert image {src}: {e}")
         return src
 
+# Shrunk images keyed by content hash: consecutive modifies in the same frame resend an
+# identical frame export, which then skips the decode/resize/encode.
+_SHRINK_CACHE_SIZE = 16
+_shrink_cache = OrderedDict()
+_shrink_cache_lock = threading.Lock() # Callers run in to_thread workers; the resize itself stays unlocked
+
+def shrink_image_for_vision(image_bytes, max_dim, quality=80):
+    """
+    Downscales an image so neither side exceeds max_dim and re-encodes it as WebP.
+    Returns (bytes, mime_type); the original PNG is returned unchanged if it cannot be decoded.
+    Results are cached by content hash.
+    """
+    cache_key = (hashlib.sha1(image_bytes).digest(), max_dim, quality)
+    with _shrink_cache_lock:
+        cached = _shrink_cache.get(cache_key)
+        if cached is not None:
+            _shrink_cache.move_to_end(cache_key)
+            return cached
+    result = _shrink_image_for_vision(image_bytes, max_dim, quality)
+    with _shrink_cache_lock:
+        _shrink_cache[cache_key] = result
+        if len(_shrink_cache) > _SHRINK_CACHE_SIZE:
+            _shrink_cache.popitem(last=False)
+    return result
+
+def _shrink_image_for_vision(image_bytes, max_dim, quality):
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS) # Only ever shrinks, keeps aspect ratio
+            out = io.BytesIO()
+            img.save(out, format="WEBP", quality=quality)
+            return out.getvalue(), "image/webp"
+    except Exception as e:
+        print(f"Could not shrink image, sending original: {e}")
+        return image_bytes, "image/png"
+
 def replace_svg_image_links_with_base64(svg_content):
     """Replaces <image> tags' href or xlink:href in SVG content with base64 image data."""
     soup = BeautifulSoup(svg_content, 'lxml-xml')  # 'xml' parser preserves SVG structure